@@ -23,7 +23,9 @@ __all__ = [
     
     # From utils
     "now",
+    "now_ns",
     "hash_credentials",
+    "verify_credentials",
     "validate_uuid",
     "validate_user_id",
     "validate_password",
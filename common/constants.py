@@ -1,8 +1,11 @@
 """Grid-X Common Constants
 
 This module contains all shared constants used across coordinator and worker modules.
+Mapping constants are read-only views so they can be shared without defensive copies.
 """
 
+from types import MappingProxyType as _MappingProxyType
+
 # ============================================================================
 # DEFAULT VALUES
 # ============================================================================
@@ -38,24 +41,24 @@ TASK_STATUS_FAILED = "failed"
 # LANGUAGE SUPPORT
 # ============================================================================
 
-SUPPORTED_LANGUAGES = ["python", "javascript", "node", "bash"]
+SUPPORTED_LANGUAGES = frozenset({"python", "javascript", "node", "bash"})
 DEFAULT_LANGUAGE = "python"
 
 # Docker images for each language
-DOCKER_IMAGES = {
+DOCKER_IMAGES = _MappingProxyType({
     'python': 'python:3.11-slim',
     'node': 'node:20-slim',
     'javascript': 'node:20-slim',
     'bash': 'ubuntu:22.04',
-}
+})
 
 # File extensions for each language
-LANGUAGE_EXTENSIONS = {
+LANGUAGE_EXTENSIONS = _MappingProxyType({
     'python': '.py',
     'javascript': '.js',
     'node': '.js',
     'bash': '.sh',
-}
+})
 
 # ============================================================================
 # CREDIT SYSTEM
@@ -92,6 +95,11 @@ MAX_EXECUTION_TIME = 3600  # 1 hour
 
 # Queue limits
 MAX_QUEUE_SIZE = 1000
+
+# Job priority accepted on submit (lower runs first)
+DEFAULT_JOB_PRIORITY = 0
+MIN_JOB_PRIORITY = -10
+MAX_JOB_PRIORITY = 10
 MAX_COMPLETED_TASKS = 100
 
 # ============================================================================
@@ -106,6 +114,7 @@ MAX_PASSWORD_LENGTH = 128
 MAX_USER_ID_LENGTH = 64
 MAX_CODE_LENGTH = 1_000_000  # 1MB
 MAX_OUTPUT_LENGTH = 10_000_000  # 10MB
+MAX_STORED_OUTPUT_LENGTH = 262_144  # 256KiB of stdout/stderr kept in the jobs row
 
 # Rate limiting
 RATE_LIMIT_REQUESTS = 100
@@ -168,18 +177,19 @@ HTTP_PAYMENT_REQUIRED = 402
 HTTP_FORBIDDEN = 403
 HTTP_NOT_FOUND = 404
 HTTP_INTERNAL_ERROR = 500
+HTTP_SERVICE_UNAVAILABLE = 503
 
 # ============================================================================
 # WORKER CONFIGURATION
 # ============================================================================
 
 # Worker capabilities
-DEFAULT_WORKER_CAPABILITIES = {
+DEFAULT_WORKER_CAPABILITIES = _MappingProxyType({
     "cpu_cores": DEFAULT_CPU_CORES,
     "memory_mb": DEFAULT_MEMORY_MB,
     "gpu_count": 0,
     "gpu_memory_mb": 0,
-}
+})
 
 # Task execution
 MAX_CONCURRENT_TASKS = 5
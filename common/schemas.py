@@ -1,12 +1,32 @@
 """Grid-X Common Data Schemas
 
 This module contains shared data schemas and models used across the platform.
+
+to_dict() methods build their dict literally instead of calling
+dataclasses.asdict(), which deep-copies every field on each call. Nested
+dicts are shallow-copied where asdict() would have copied them.
 """
 
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass
 from typing import Dict, Any, Optional, List
 from enum import Enum
 
+from .constants import (
+    STATUS_QUEUED,
+    STATUS_RUNNING,
+    STATUS_COMPLETED,
+    STATUS_FAILED,
+    STATUS_CANCELLED,
+    WORKER_STATUS_IDLE,
+    WORKER_STATUS_BUSY,
+    WORKER_STATUS_OFFLINE,
+    TASK_STATUS_PENDING,
+    TASK_STATUS_RUNNING,
+    TASK_STATUS_COMPLETED,
+    TASK_STATUS_FAILED,
+    SUPPORTED_LANGUAGES,
+)
+
 
 # ============================================================================
 # ENUMS
@@ -14,26 +34,26 @@ from enum import Enum
 
 class JobStatus(str, Enum):
     """Job execution status"""
-    QUEUED = "queued"
-    RUNNING = "running"
-    COMPLETED = "completed"
-    FAILED = "failed"
-    CANCELLED = "cancelled"
+    QUEUED = STATUS_QUEUED
+    RUNNING = STATUS_RUNNING
+    COMPLETED = STATUS_COMPLETED
+    FAILED = STATUS_FAILED
+    CANCELLED = STATUS_CANCELLED
 
 
 class WorkerStatus(str, Enum):
     """Worker availability status"""
-    IDLE = "idle"
-    BUSY = "busy"
-    OFFLINE = "offline"
+    IDLE = WORKER_STATUS_IDLE
+    BUSY = WORKER_STATUS_BUSY
+    OFFLINE = WORKER_STATUS_OFFLINE
 
 
 class TaskStatus(str, Enum):
     """Task execution status"""
-    PENDING = "pending"
-    RUNNING = "running"
-    COMPLETED = "completed"
-    FAILED = "failed"
+    PENDING = TASK_STATUS_PENDING
+    RUNNING = TASK_STATUS_RUNNING
+    COMPLETED = TASK_STATUS_COMPLETED
+    FAILED = TASK_STATUS_FAILED
 
 
 class Language(str, Enum):
@@ -44,11 +64,34 @@ class Language(str, Enum):
     BASH = "bash"
 
 
+# Default status values resolved once instead of via Enum attribute + .value per use
+_JS_QUEUED = JobStatus.QUEUED.value
+_WS_IDLE = WorkerStatus.IDLE.value
+_TS_PENDING = TaskStatus.PENDING.value
+
+
+# Preallocated JobSubmission.validate results
+_JS_NO_CODE = (False, "Code is required and must be a string")
+_JS_TOO_LONG = (False, "Code exceeds maximum length of 1MB")
+_JS_BAD_LANG_TMPL = "Unsupported language: {}"
+_JS_OK = (True, None)
+
+
 # ============================================================================
 # JOB SCHEMAS
 # ============================================================================
 
-@dataclass
+# Defaults for JobLimits.from_dict(). Each from_dict() overlays the input on its
+# defaults with one dict merge instead of a .get() call per field.
+_JOB_LIMITS_DEFAULTS = {
+    'cpu_cores': 1,
+    'memory_mb': 512,
+    'timeout_seconds': 300,
+    'max_output_bytes': 10_000_000
+}
+
+
+@dataclass(slots=True)
 class JobLimits:
     """Resource limits for job execution"""
     cpu_cores: int = 1
@@ -58,27 +101,54 @@ class JobLimits:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary"""
-        return asdict(self)
+        return {
+            'cpu_cores': self.cpu_cores,
+            'memory_mb': self.memory_mb,
+            'timeout_seconds': self.timeout_seconds,
+            'max_output_bytes': self.max_output_bytes
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'JobLimits':
         """Create from dictionary"""
+        merged = {**_JOB_LIMITS_DEFAULTS, **data}
         return cls(
-            cpu_cores=data.get('cpu_cores', 1),
-            memory_mb=data.get('memory_mb', 512),
-            timeout_seconds=data.get('timeout_seconds', 300),
-            max_output_bytes=data.get('max_output_bytes', 10_000_000)
+            cpu_cores=merged['cpu_cores'],
+            memory_mb=merged['memory_mb'],
+            timeout_seconds=merged['timeout_seconds'],
+            max_output_bytes=merged['max_output_bytes']
         )
 
 
-@dataclass
+# Defaults for JobSchema.from_dict()
+_JOB_DEFAULTS = {
+    'id': '',
+    'job_id': '',
+    'user_id': '',
+    'code': '',
+    'language': 'python',
+    'status': _JS_QUEUED,
+    'worker_id': None,
+    'created_at': None,
+    'started_at': None,
+    'completed_at': None,
+    'stdout': '',
+    'stderr': '',
+    'exit_code': None,
+    'error_message': None,
+    'limits': None,
+    'cost': 1.0
+}
+
+
+@dataclass(slots=True)
 class JobSchema:
     """Standard job schema"""
     job_id: str
     user_id: str
     code: str
     language: str = "python"
-    status: str = JobStatus.QUEUED.value
+    status: str = _JS_QUEUED
     worker_id: Optional[str] = None
     created_at: Optional[float] = None
     started_at: Optional[float] = None
@@ -113,26 +183,27 @@ class JobSchema:
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'JobSchema':
         """Create from dictionary"""
+        merged = {**_JOB_DEFAULTS, **data}
         return cls(
-            job_id=data.get('id') or data.get('job_id', ''),
-            user_id=data.get('user_id', ''),
-            code=data.get('code', ''),
-            language=data.get('language', 'python'),
-            status=data.get('status', JobStatus.QUEUED.value),
-            worker_id=data.get('worker_id'),
-            created_at=data.get('created_at'),
-            started_at=data.get('started_at'),
-            completed_at=data.get('completed_at'),
-            stdout=data.get('stdout', ''),
-            stderr=data.get('stderr', ''),
-            exit_code=data.get('exit_code'),
-            error_message=data.get('error_message'),
-            limits=data.get('limits'),
-            cost=data.get('cost', 1.0)
+            job_id=merged['id'] or merged['job_id'],
+            user_id=merged['user_id'],
+            code=merged['code'],
+            language=merged['language'],
+            status=merged['status'],
+            worker_id=merged['worker_id'],
+            created_at=merged['created_at'],
+            started_at=merged['started_at'],
+            completed_at=merged['completed_at'],
+            stdout=merged['stdout'],
+            stderr=merged['stderr'],
+            exit_code=merged['exit_code'],
+            error_message=merged['error_message'],
+            limits=merged['limits'],
+            cost=merged['cost']
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class JobSubmission:
     """Job submission request"""
     code: str
@@ -143,22 +214,32 @@ class JobSubmission:
     def validate(self) -> tuple[bool, Optional[str]]:
         """Validate job submission"""
         if not self.code or not isinstance(self.code, str):
-            return False, "Code is required and must be a string"
+            return _JS_NO_CODE
         
         if len(self.code) > 1_000_000:
-            return False, "Code exceeds maximum length of 1MB"
+            return _JS_TOO_LONG
         
-        if self.language not in ['python', 'javascript', 'node', 'bash']:
-            return False, f"Unsupported language: {self.language}"
+        if not isinstance(self.language, str) or self.language not in SUPPORTED_LANGUAGES:
+            return False, _JS_BAD_LANG_TMPL.format(self.language)
         
-        return True, None
+        return _JS_OK
 
 
 # ============================================================================
 # WORKER SCHEMAS
 # ============================================================================
 
-@dataclass
+# Defaults for WorkerCapabilities.from_dict()
+_WORKER_CAPS_DEFAULTS = {
+    'cpu_cores': 1,
+    'memory_mb': 512,
+    'gpu_count': 0,
+    'gpu_memory_mb': 0,
+    'disk_gb': 10
+}
+
+
+@dataclass(slots=True)
 class WorkerCapabilities:
     """Worker hardware capabilities"""
     cpu_cores: int = 1
@@ -169,26 +250,49 @@ class WorkerCapabilities:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary"""
-        return asdict(self)
+        return {
+            'cpu_cores': self.cpu_cores,
+            'memory_mb': self.memory_mb,
+            'gpu_count': self.gpu_count,
+            'gpu_memory_mb': self.gpu_memory_mb,
+            'disk_gb': self.disk_gb
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'WorkerCapabilities':
         """Create from dictionary"""
+        merged = {**_WORKER_CAPS_DEFAULTS, **data}
         return cls(
-            cpu_cores=data.get('cpu_cores', 1),
-            memory_mb=data.get('memory_mb', 512),
-            gpu_count=data.get('gpu_count', 0),
-            gpu_memory_mb=data.get('gpu_memory_mb', 0),
-            disk_gb=data.get('disk_gb', 10)
+            cpu_cores=merged['cpu_cores'],
+            memory_mb=merged['memory_mb'],
+            gpu_count=merged['gpu_count'],
+            gpu_memory_mb=merged['gpu_memory_mb'],
+            disk_gb=merged['disk_gb']
         )
 
 
-@dataclass
+# Defaults for WorkerSchema.from_dict()
+_WORKER_DEFAULTS = {
+    'id': '',
+    'owner_id': '',
+    'status': _WS_IDLE,
+    'ip_address': 'unknown',
+    'capabilities': None,
+    'auth_token': None,
+    'last_heartbeat': None,
+    'registered_at': None,
+    'current_job_id': None,
+    'jobs_completed': 0,
+    'credits_earned': 0.0
+}
+
+
+@dataclass(slots=True)
 class WorkerSchema:
     """Standard worker schema"""
     id: str
     owner_id: str
-    status: str = WorkerStatus.IDLE.value
+    status: str = _WS_IDLE
     ip_address: str = "unknown"
     capabilities: Optional[Dict[str, Any]] = None
     auth_token: Optional[str] = None
@@ -217,18 +321,19 @@ class WorkerSchema:
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'WorkerSchema':
         """Create from dictionary"""
+        merged = {**_WORKER_DEFAULTS, **data}
         return cls(
-            id=data.get('id', ''),
-            owner_id=data.get('owner_id', ''),
-            status=data.get('status', WorkerStatus.IDLE.value),
-            ip_address=data.get('ip_address', 'unknown'),
-            capabilities=data.get('capabilities'),
-            auth_token=data.get('auth_token'),
-            last_heartbeat=data.get('last_heartbeat'),
-            registered_at=data.get('registered_at'),
-            current_job_id=data.get('current_job_id'),
-            jobs_completed=data.get('jobs_completed', 0),
-            credits_earned=data.get('credits_earned', 0.0)
+            id=merged['id'],
+            owner_id=merged['owner_id'],
+            status=merged['status'],
+            ip_address=merged['ip_address'],
+            capabilities=merged['capabilities'],
+            auth_token=merged['auth_token'],
+            last_heartbeat=merged['last_heartbeat'],
+            registered_at=merged['registered_at'],
+            current_job_id=merged['current_job_id'],
+            jobs_completed=merged['jobs_completed'],
+            credits_earned=merged['credits_earned']
         )
 
 
@@ -236,7 +341,17 @@ class WorkerSchema:
 # CREDIT SCHEMAS
 # ============================================================================
 
-@dataclass
+# Defaults for CreditBalance.from_dict()
+_CREDIT_BALANCE_DEFAULTS = {
+    'user_id': '',
+    'balance': 100.0,
+    'total_earned': 0.0,
+    'total_spent': 0.0,
+    'last_updated': None
+}
+
+
+@dataclass(slots=True)
 class CreditBalance:
     """User credit balance"""
     user_id: str
@@ -247,21 +362,28 @@ class CreditBalance:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary"""
-        return asdict(self)
+        return {
+            'user_id': self.user_id,
+            'balance': self.balance,
+            'total_earned': self.total_earned,
+            'total_spent': self.total_spent,
+            'last_updated': self.last_updated
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'CreditBalance':
         """Create from dictionary"""
+        merged = {**_CREDIT_BALANCE_DEFAULTS, **data}
         return cls(
-            user_id=data.get('user_id', ''),
-            balance=data.get('balance', 100.0),
-            total_earned=data.get('total_earned', 0.0),
-            total_spent=data.get('total_spent', 0.0),
-            last_updated=data.get('last_updated')
+            user_id=merged['user_id'],
+            balance=merged['balance'],
+            total_earned=merged['total_earned'],
+            total_spent=merged['total_spent'],
+            last_updated=merged['last_updated']
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class CreditTransaction:
     """Credit transaction record"""
     transaction_id: str
@@ -275,19 +397,42 @@ class CreditTransaction:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary"""
-        return asdict(self)
+        return {
+            'transaction_id': self.transaction_id,
+            'user_id': self.user_id,
+            'amount': self.amount,
+            'transaction_type': self.transaction_type,
+            'description': self.description,
+            'timestamp': self.timestamp,
+            'related_job_id': self.related_job_id,
+            'related_worker_id': self.related_worker_id
+        }
 
 
 # ============================================================================
 # TASK SCHEMAS
 # ============================================================================
 
-@dataclass
+# Defaults for TaskSchema.from_dict()
+_TASK_DEFAULTS = {
+    'task_id': '',
+    'job_id': '',
+    'status': _TS_PENDING,
+    'created_at': 0.0,
+    'started_at': None,
+    'completed_at': None,
+    'result': None,
+    'error': None,
+    'priority': 0
+}
+
+
+@dataclass(slots=True)
 class TaskSchema:
     """Task execution schema"""
     task_id: str
     job_id: str
-    status: str = TaskStatus.PENDING.value
+    status: str = _TS_PENDING
     created_at: float = 0.0
     started_at: Optional[float] = None
     completed_at: Optional[float] = None
@@ -297,21 +442,32 @@ class TaskSchema:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary"""
-        return asdict(self)
+        return {
+            'task_id': self.task_id,
+            'job_id': self.job_id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'completed_at': self.completed_at,
+            'result': dict(self.result) if self.result is not None else None,
+            'error': self.error,
+            'priority': self.priority
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'TaskSchema':
         """Create from dictionary"""
+        merged = {**_TASK_DEFAULTS, **data}
         return cls(
-            task_id=data.get('task_id', ''),
-            job_id=data.get('job_id', ''),
-            status=data.get('status', TaskStatus.PENDING.value),
-            created_at=data.get('created_at', 0.0),
-            started_at=data.get('started_at'),
-            completed_at=data.get('completed_at'),
-            result=data.get('result'),
-            error=data.get('error'),
-            priority=data.get('priority', 0)
+            task_id=merged['task_id'],
+            job_id=merged['job_id'],
+            status=merged['status'],
+            created_at=merged['created_at'],
+            started_at=merged['started_at'],
+            completed_at=merged['completed_at'],
+            result=merged['result'],
+            error=merged['error'],
+            priority=merged['priority']
         )
 
 
@@ -319,18 +475,18 @@ class TaskSchema:
 # WEBSOCKET MESSAGE SCHEMAS
 # ============================================================================
 
-@dataclass
+@dataclass(slots=True)
 class WebSocketMessage:
     """WebSocket message schema"""
     type: str
-    data: Dict[str, Any] = field(default_factory=dict)
+    data: Optional[Dict[str, Any]] = None  # None serializes as {}
     timestamp: Optional[float] = None
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary"""
         return {
             'type': self.type,
-            'data': self.data,
+            'data': self.data if self.data is not None else {},
             'timestamp': self.timestamp
         }
     
@@ -339,7 +495,7 @@ class WebSocketMessage:
         """Create from dictionary"""
         return cls(
             type=data.get('type', ''),
-            data=data.get('data', {}),
+            data=data.get('data'),
             timestamp=data.get('timestamp')
         )
 
@@ -348,7 +504,7 @@ class WebSocketMessage:
 # RESPONSE SCHEMAS
 # ============================================================================
 
-@dataclass
+@dataclass(slots=True)
 class ApiResponse:
     """Standard API response"""
     success: bool
@@ -370,7 +526,7 @@ class ApiResponse:
         return result
 
 
-@dataclass
+@dataclass(slots=True)
 class ErrorResponse:
     """Error response schema"""
     error: str
@@ -4,12 +4,29 @@ This module contains shared utility functions used across coordinator and worker
 """
 
 import hashlib
-import re
+import hmac
+import secrets
+import string
 import time
 import uuid
+from collections import ChainMap
 from typing import Any, Optional
 from datetime import datetime
 
+# Character sets for the validators (set checks run in C; no regex engine per call)
+_UUID_CHARS = frozenset('0123456789abcdefABCDEF-')
+_UUID_VARIANT_CHARS = frozenset('89abAB')
+
+
+_USER_ID_CHARS = frozenset(string.ascii_letters + string.digits + '_-')
+
+# Fixed str.translate tables (precomputed, never grow with input):
+# - deletes the ASCII controls except tab/newline/CR, and DEL (used by sanitize_string on ASCII input)
+_CONTROL_TABLE = dict.fromkeys([c for c in range(0x20) if chr(c) not in '\n\r\t'] + [0x7f])
+# - deletes every ASCII character outside [a-zA-Z0-9_-] (used by sanitize_user_id)
+_USER_ID_ASCII_TABLE = dict.fromkeys(c for c in range(0x80) if chr(c) not in _USER_ID_CHARS)
+
+
 # ============================================================================
 # TIME & TIMESTAMP UTILITIES
 # ============================================================================
@@ -19,15 +36,20 @@ def now() -> float:
     return time.time()
 
 
+def now_ns() -> int:
+    """Get current timestamp in integer nanoseconds since epoch (no float rounding)"""
+    return time.time_ns()
+
+
 def timestamp_to_datetime(timestamp: float) -> datetime:
     """Convert Unix timestamp to datetime object"""
     return datetime.fromtimestamp(timestamp)
 
 
 def format_timestamp(timestamp: float) -> str:
-    """Format timestamp as human-readable string"""
-    dt = timestamp_to_datetime(timestamp)
-    return dt.strftime("%Y-%m-%d %H:%M:%S")
+    """Format timestamp as human-readable string (YYYY-MM-DD HH:MM:SS)"""
+    # isoformat() yields the same text as strftime without parsing a format string
+    return datetime.fromtimestamp(timestamp).isoformat(sep=' ', timespec='seconds')
 
 
 def format_duration(seconds: float) -> str:
@@ -46,19 +68,61 @@ def format_duration(seconds: float) -> str:
 # HASHING & SECURITY
 # ============================================================================
 
+# Versioned credential hash prefixes: BLAKE2b for new hashes, SHA256 for legacy
+CREDENTIAL_HASH_BLAKE2B = "b2$"
+CREDENTIAL_HASH_SHA256 = "s2$"
+
+
+def _credential_digest(hasher: Any, user_id: str, password: str) -> str:
+    """Feed "user_id:password" into hasher piecewise (no joined intermediate string)"""
+    hasher.update(user_id.encode())
+    hasher.update(b':')
+    hasher.update(password.encode())
+    return hasher.hexdigest()
+
+
 def hash_credentials(user_id: str, password: str) -> str:
     """
-    Create SHA256 hash of credentials for authentication
+    Create BLAKE2b hash of credentials for authentication
+    
+    The result is prefixed with its algorithm tag so that stored hashes
+    can be verified with the algorithm that produced them.
+    
+    Args:
+        user_id: User identifier
+        password: User password
+        
+    Returns:
+        Prefixed hexadecimal hash string (e.g. "b2$...")
+    """
+    digest = _credential_digest(hashlib.blake2b(digest_size=32), user_id, password)
+    return CREDENTIAL_HASH_BLAKE2B + digest
+
+
+def verify_credentials(user_id: str, password: str, stored_hash: str) -> bool:
+    """
+    Verify credentials against a stored hash
+    
+    Selects the algorithm from the stored hash prefix. Unprefixed hashes
+    are treated as legacy SHA256 hex digests.
     
     Args:
         user_id: User identifier
         password: User password
+        stored_hash: Hash previously produced by hash_credentials
         
     Returns:
-        Hexadecimal hash string
+        True if credentials match, False otherwise
     """
-    combined = f"{user_id}:{password}"
-    return hashlib.sha256(combined.encode()).hexdigest()
+    if not stored_hash:
+        return False
+    if stored_hash.startswith(CREDENTIAL_HASH_BLAKE2B):
+        expected = hash_credentials(user_id, password)
+    elif stored_hash.startswith(CREDENTIAL_HASH_SHA256):
+        expected = CREDENTIAL_HASH_SHA256 + _credential_digest(hashlib.sha256(), user_id, password)
+    else:
+        expected = _credential_digest(hashlib.sha256(), user_id, password)
+    return hmac.compare_digest(expected, stored_hash)
 
 
 def hash_string(text: str) -> str:
@@ -67,14 +131,25 @@ def hash_string(text: str) -> str:
 
 
 def generate_token() -> str:
-    """Generate a secure random token"""
-    return hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+    """Generate a secure random token (256 bits of entropy, 64 hex chars)"""
+    return secrets.token_hex(32)
 
 
 # ============================================================================
 # INPUT VALIDATION
 # ============================================================================
 
+# Preallocated validate_password results (returned as-is, no per-call tuples)
+_PW_EMPTY = (False, "Password is required")
+_PW_SHORT = (False, "Password must be at least 8 characters long")
+_PW_LONG = (False, "Password must be at most 128 characters long")
+_PW_OK = (True, None)
+
+# Preallocated validate_code results
+_CODE_MISSING = (False, "Missing or invalid 'code' field")
+_CODE_NUL = (False, "Code must not contain NUL bytes")
+_CODE_OK = (True, None)
+
 def validate_uuid(value: str) -> bool:
     """
     Validate UUID format (version 4)
@@ -85,11 +160,16 @@ def validate_uuid(value: str) -> bool:
     Returns:
         True if valid UUID, False otherwise
     """
-    uuid_pattern = re.compile(
-        r'^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$',
-        re.IGNORECASE
+    # 8-4-4-4-12 hex with version nibble 4 and variant 8/9/a/b; exactly four
+    # dashes, so the fixed positions are the only ones
+    return (
+        len(value) == 36
+        and value[8] == value[13] == value[18] == value[23] == '-'
+        and value[14] == '4'
+        and value[19] in _UUID_VARIANT_CHARS
+        and value.count('-') == 4
+        and _UUID_CHARS.issuperset(value)
     )
-    return bool(uuid_pattern.match(value))
 
 
 def validate_user_id(user_id: str) -> bool:
@@ -111,7 +191,34 @@ def validate_user_id(user_id: str) -> bool:
         return False
     if len(user_id) < 1 or len(user_id) > 64:
         return False
-    return bool(re.match(r'^[a-zA-Z0-9_-]+$', user_id))
+    return _USER_ID_CHARS.issuperset(user_id)
+
+
+def validate_code(code: Any, max_length: int = 1_000_000) -> tuple[bool, Optional[str]]:
+    """
+    Validate submitted source code
+    
+    Rules:
+    - Non-empty string of at most max_length characters
+    - No NUL bytes (interpreters reject them)
+    
+    Code is stored and executed, never rendered, so other characters are kept
+    verbatim; the check is one C-level scan with no copy (unlike sanitize_string).
+    
+    Args:
+        code: Source code to validate
+        max_length: Maximum allowed length
+        
+    Returns:
+        Tuple of (is_valid, error_message)
+    """
+    if not code or not isinstance(code, str):
+        return _CODE_MISSING
+    if len(code) > max_length:
+        return (False, f"Code exceeds maximum size of {max_length} characters")
+    if "\x00" in code:
+        return _CODE_NUL
+    return _CODE_OK
 
 
 def validate_password(password: str) -> tuple[bool, Optional[str]]:
@@ -129,15 +236,14 @@ def validate_password(password: str) -> tuple[bool, Optional[str]]:
         Tuple of (is_valid, error_message)
     """
     if not password or not isinstance(password, str):
-        return False, "Password is required"
-    
-    if len(password) < 8:
-        return False, "Password must be at least 8 characters long"
-    
-    if len(password) > 128:
-        return False, "Password must be at most 128 characters long"
+        return _PW_EMPTY
     
-    return True, None
+    length = len(password)
+    if length < 8:
+        return _PW_SHORT
+    if length > 128:
+        return _PW_LONG
+    return _PW_OK
 
 
 def validate_language(language: str) -> bool:
@@ -151,7 +257,8 @@ def validate_language(language: str) -> bool:
         True if supported language, False otherwise
     """
     from .constants import SUPPORTED_LANGUAGES
-    return language in SUPPORTED_LANGUAGES
+    # Frozenset membership hashes its operand; lists/dicts would raise TypeError
+    return isinstance(language, str) and language in SUPPORTED_LANGUAGES
 
 
 def validate_code_length(code: str, max_length: int = 1_000_000) -> bool:
@@ -190,12 +297,14 @@ def sanitize_string(value: Any, max_length: int = 1000) -> str:
     if not isinstance(value, str):
         value = str(value)
     
-    # Remove null bytes
-    value = value.replace('\x00', '')
-    
-    # Remove other control characters except newlines and tabs
-    value = ''.join(char for char in value 
-                   if char.isprintable() or char in '\n\r\t')
+    # Remove null bytes and other control characters except newlines and tabs
+    if not value.isprintable():
+        if value.isascii():
+            value = value.translate(_CONTROL_TABLE)
+        else:
+            # Non-ASCII non-printables (format chars, separators, ...): filter char by char
+            value = ''.join(char for char in value
+                            if char.isprintable() or char in '\n\r\t')
     
     # Limit length
     return value[:max_length]
@@ -212,7 +321,10 @@ def sanitize_user_id(user_id: str) -> str:
         Sanitized user ID
     """
     # Remove all non-alphanumeric, non-underscore, non-hyphen characters
-    sanitized = re.sub(r'[^a-zA-Z0-9_-]', '', user_id)
+    if user_id.isascii():
+        sanitized = user_id.translate(_USER_ID_ASCII_TABLE)
+    else:
+        sanitized = ''.join(char for char in user_id if char in _USER_ID_CHARS)
     return sanitized[:64]
 
 
@@ -220,6 +332,9 @@ def sanitize_user_id(user_id: str) -> str:
 # FORMATTING UTILITIES
 # ============================================================================
 
+_BYTE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB', 'EB')
+
+
 def format_bytes(bytes_val: int) -> str:
     """
     Format bytes to human-readable string
@@ -230,11 +345,11 @@ def format_bytes(bytes_val: int) -> str:
     Returns:
         Formatted string (e.g., "1.50 GB")
     """
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB', 'PB']:
-        if bytes_val < 1024.0:
-            return f"{bytes_val:.2f} {unit}"
-        bytes_val /= 1024.0
-    return f"{bytes_val:.2f} EB"
+    if bytes_val < 1024:
+        return f"{bytes_val:.2f} B"
+    # Each unit step is a factor of 2**10, so the unit index follows from the bit length
+    index = min((int(bytes_val).bit_length() - 1) // 10, len(_BYTE_UNITS) - 1)
+    return f"{bytes_val / (1 << (index * 10)):.2f} {_BYTE_UNITS[index]}"
 
 
 def format_percentage(value: float) -> str:
@@ -314,13 +429,33 @@ def merge_dicts(*dicts: dict) -> dict:
     Returns:
         Merged dictionary
     """
+    present = [d for d in dicts if d]
+    if len(present) == 2:
+        # Common two-dict case: one literal merge; unlike `a | b` it always builds
+        # a plain dict (any Mapping works, subclasses' __or__ is not involved)
+        return {**present[0], **present[1]}
     result = {}
-    for d in dicts:
-        if d:
-            result.update(d)
+    for d in present:
+        result.update(d)
     return result
 
 
+def chain_dicts(*dicts: dict) -> ChainMap:
+    """
+    Read-only merged view of multiple dictionaries without copying
+    
+    Lookup precedence matches merge_dicts (later dicts override earlier
+    ones). Use when the caller only reads from the merged result.
+    
+    Args:
+        *dicts: Variable number of dictionaries
+        
+    Returns:
+        ChainMap over the non-empty dictionaries
+    """
+    return ChainMap(*[d for d in reversed(dicts) if d])
+
+
 def remove_none_values(dictionary: dict) -> dict:
     """
     Remove keys with None values from dictionary
@@ -338,6 +473,8 @@ def remove_none_values(dictionary: dict) -> dict:
 # ERROR HANDLING UTILITIES
 # ============================================================================
 
+_TRUTHY_STRINGS = frozenset(('true', '1', 'yes', 'on'))
+
 def safe_int(value: Any, default: int = 0) -> int:
     """
     Safely convert value to int
@@ -349,6 +486,9 @@ def safe_int(value: Any, default: int = 0) -> int:
     Returns:
         Integer value or default
     """
+    # Fast path: avoid the try/except setup for values that are already ints
+    if type(value) is int:
+        return value
     try:
         return int(value)
     except (ValueError, TypeError):
@@ -366,6 +506,11 @@ def safe_float(value: Any, default: float = 0.0) -> float:
     Returns:
         Float value or default
     """
+    value_type = type(value)
+    if value_type is float:
+        return value
+    if value_type is int:
+        return float(value)
     try:
         return float(value)
     except (ValueError, TypeError):
@@ -386,7 +531,7 @@ def safe_bool(value: Any, default: bool = False) -> bool:
     if isinstance(value, bool):
         return value
     if isinstance(value, str):
-        return value.lower() in ('true', '1', 'yes', 'on')
+        return value.lower() in _TRUTHY_STRINGS
     try:
         return bool(value)
     except (ValueError, TypeError):
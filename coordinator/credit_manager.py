@@ -6,9 +6,15 @@ Reserve max at submit, then settle (refund unused + pay worker) when job complet
 
 import os
 import logging
+import sqlite3
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 
-from .database import get_db, now, db_get_job
+from .database import (
+    get_db, now, db_get_job, db_invalidate_job_cache, db_transaction, db_has_duration_seconds,
+    SQLITE_HAS_RETURNING,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -27,29 +33,48 @@ DEFAULT_JOB_TIMEOUT = int(os.getenv("GRIDX_DEFAULT_JOB_TIMEOUT", "60"))
 DEFAULT_INITIAL_BALANCE = float(os.getenv("GRIDX_INITIAL_CREDITS", "100.0"))
 
 
+@dataclass(frozen=True, slots=True)
+class _Rates:
+    """Rate snapshot bound as a default arg in hot functions (LOAD_FAST + slot read, not LOAD_GLOBAL)"""
+    cps: float
+    min_c: float
+    max_c: float
+    reward: float
+    timeout: int
+
+
+_RATES = _Rates(COST_PER_SECOND, MIN_COST, MAX_COST, REWARD_RATIO, DEFAULT_JOB_TIMEOUT)
+
+# ----- Hot-path SQL (shared string objects keep sqlite3's statement cache warm) -----
+SQL_SELECT_BALANCE = "SELECT balance FROM user_credits WHERE user_id=?"
+SQL_INSERT_USER = "INSERT INTO user_credits(user_id, balance, last_updated) VALUES(?,?,?)"
+SQL_DEDUCT = "UPDATE user_credits SET balance=balance-?, last_updated=? WHERE user_id=? AND balance>=?"
+SQL_DEDUCT_RETURNING = SQL_DEDUCT + " RETURNING balance"
+# Upsert: creates the user with `amount` or adds it to the existing balance (one statement, one PK probe)
+SQL_CREDIT = (
+    "INSERT INTO user_credits(user_id, balance, last_updated) VALUES(?,?,?) "
+    "ON CONFLICT(user_id) DO UPDATE SET balance=balance+excluded.balance, last_updated=excluded.last_updated"
+)
+SQL_SETTLE_JOB = "UPDATE jobs SET duration_seconds=?, cost=? WHERE id=?"
+# Pre-migration databases (init_db() could not add duration_seconds)
+SQL_SETTLE_JOB_LEGACY = "UPDATE jobs SET cost=? WHERE id=?"
+
+
 def ensure_user(user_id: str, initial_balance: Optional[float] = None) -> float:
     """Ensure user exists; create with initial balance if not. Returns current balance."""
     if initial_balance is None:
         initial_balance = DEFAULT_INITIAL_BALANCE
     DB = get_db()
-    row = DB.execute(
-        "SELECT balance FROM user_credits WHERE user_id=?", (user_id,)
-    ).fetchone()
+    row = DB.execute(SQL_SELECT_BALANCE, (user_id,)).fetchone()
     if row is not None:
         return float(row[0])
-    DB.execute(
-        "INSERT INTO user_credits(user_id, balance, last_updated) VALUES(?,?,?)",
-        (user_id, initial_balance, now()),
-    )
-    DB.commit()
+    DB.execute(SQL_INSERT_USER, (user_id, initial_balance, now()))
     return initial_balance
 
 
 def get_balance(user_id: str) -> float:
     """Return current balance; 0 if user does not exist."""
-    row = get_db().execute(
-        "SELECT balance FROM user_credits WHERE user_id=?", (user_id,)
-    ).fetchone()
+    row = get_db().execute(SQL_SELECT_BALANCE, (user_id,)).fetchone()
     if row is None:
         return 0.0
     return float(row[0])
@@ -60,58 +85,79 @@ def deduct(user_id: str, amount: float) -> bool:
     if amount <= 0:
         return True
     DB = get_db()
-    cur = DB.execute(
-        "UPDATE user_credits SET balance=balance-?, last_updated=? WHERE user_id=? AND balance>=?",
-        (amount, now(), user_id, amount),
-    )
-    DB.commit()
+    cur = DB.execute(SQL_DEDUCT, (amount, now(), user_id, amount))
     return cur.rowcount > 0
 
 
+def deduct_returning(user_id: str, amount: float) -> Optional[float]:
+    """
+    Atomically deduct amount and return the new balance.
+    Returns None if the user is missing or has insufficient balance.
+    """
+    if amount <= 0:
+        return get_balance(user_id)
+    if not SQLITE_HAS_RETURNING:
+        return get_balance(user_id) if deduct(user_id, amount) else None
+    with db_transaction() as conn:
+        row = conn.execute(SQL_DEDUCT_RETURNING, (amount, now(), user_id, amount)).fetchone()
+    return float(row[0]) if row is not None else None
+
+
 def credit(user_id: str, amount: float) -> None:
     """Add amount to user's balance. Creates user with 0 if not present."""
     if amount <= 0:
         return
-    DB = get_db()
-    ensure_user(user_id, initial_balance=0.0)
-    DB.execute(
-        "UPDATE user_credits SET balance=balance+?, last_updated=? WHERE user_id=?",
-        (amount, now(), user_id),
-    )
-    DB.commit()
+    with db_transaction() as conn:
+        _credit_nocommit(conn, user_id, amount)
+
+
+def _credit_nocommit(
+    conn: sqlite3.Connection,
+    user_id: str,
+    amount: float,
+    ts: Optional[float] = None,
+) -> None:
+    """Add amount to user's balance without committing (caller owns the transaction)."""
+    if ts is None:
+        ts = now()
+    conn.execute(SQL_CREDIT, (user_id, amount, ts))
 
 
 # ----- Time-based cost / reward -----
 
 
-def compute_cost(duration_seconds: float) -> float:
+def compute_cost(duration_seconds: float, _r: _Rates = _RATES) -> float:
     """
     Compute actual cost from duration (in seconds).
     Clamped to [MIN_COST, MAX_COST]. Uses MIN_COST if duration is missing or negative.
     """
     if duration_seconds is None or duration_seconds < 0:
-        return MIN_COST
-    raw = duration_seconds * COST_PER_SECOND
-    return max(MIN_COST, min(MAX_COST, round(raw, 4)))
+        return _r.min_c
+    cost = round(duration_seconds * _r.cps, 4)
+    cost = _r.max_c if cost > _r.max_c else cost
+    return _r.min_c if cost < _r.min_c else cost
 
 
-def compute_reward(actual_cost: float) -> float:
+def compute_reward(actual_cost: float, _r: _Rates = _RATES) -> float:
     """Compute reward to worker owner from actual cost paid by submitter."""
     if actual_cost <= 0:
         return 0.0
-    return round(actual_cost * REWARD_RATIO, 4)
+    return round(actual_cost * _r.reward, 4)
 
 
-def get_max_reserve(timeout_seconds: Optional[int] = None) -> float:
+@lru_cache(maxsize=256)
+def get_max_reserve(timeout_seconds: Optional[int] = None, _r: _Rates = _RATES) -> float:
     """
     Return the maximum amount to reserve at job submit (based on timeout).
     This is deducted upfront; unused portion is refunded when job completes.
+    Memoized: only a handful of distinct timeouts are used in practice.
     """
-    timeout = timeout_seconds if timeout_seconds is not None else DEFAULT_JOB_TIMEOUT
+    timeout = timeout_seconds if timeout_seconds is not None else _r.timeout
     if timeout <= 0:
-        timeout = DEFAULT_JOB_TIMEOUT
-    raw = timeout * COST_PER_SECOND
-    return min(MAX_COST, max(MIN_COST, round(raw, 4)))
+        timeout = _r.timeout
+    reserve = round(timeout * _r.cps, 4)
+    reserve = _r.min_c if reserve < _r.min_c else reserve
+    return _r.max_c if reserve > _r.max_c else reserve
 
 
 def settle_job(
@@ -125,14 +171,15 @@ def settle_job(
     - Computes actual cost from duration; refunds (reserved - actual) to submitter.
     - Credits worker owner (actual_cost * REWARD_RATIO).
     - Updates job row with duration_seconds and actual cost (for records).
+    All writes happen in one transaction (single commit; no partial settlement).
     """
     job = db_get_job(job_id)
     if not job:
         logger.warning(f"settle_job: Job {job_id} not found")
         return
 
-    user_id = (job.get("user_id") or "").strip()
-    reserved = float(job.get("cost") or 0)
+    user_id = (job["user_id"] or "").strip()
+    reserved = float(job["cost"] or 0)
     if reserved <= 0:
         reserved = MAX_COST
 
@@ -140,32 +187,29 @@ def settle_job(
     refund = max(0.0, reserved - actual_cost)
     reward = compute_reward(actual_cost)
 
-    # Refund unused reserve to submitter
-    if refund > 0 and user_id:
-        credit(user_id, refund)
-        logger.info(f"settle_job: Job {job_id} refunded {refund} to {user_id} (reserved={reserved}, actual={actual_cost})")
+    owner_id = (worker_owner_id or "").strip()
+    ts = now()
+
+    with db_transaction() as conn:
+        # Refund unused reserve to submitter
+        if refund > 0 and user_id:
+            _credit_nocommit(conn, user_id, refund, ts)
+            logger.info(f"settle_job: Job {job_id} refunded {refund} to {user_id} (reserved={reserved}, actual={actual_cost})")
 
-    # Pay worker owner
-    if reward > 0 and worker_owner_id and (worker_owner_id or "").strip():
-        owner_id = (worker_owner_id or "").strip()
-        if owner_id:
-            credit(owner_id, reward)
+        # Pay worker owner
+        if reward > 0 and owner_id:
+            _credit_nocommit(conn, owner_id, reward, ts)
             logger.info(f"settle_job: Job {job_id} credited {reward} to worker owner {owner_id}")
 
-    # Persist duration and actual cost on job (database module will do this if we pass it)
-    conn = get_db()
-    try:
-        conn.execute(
-            """
-            UPDATE jobs SET duration_seconds=?, cost=?
-            WHERE id=?
-            """,
-            (duration_seconds if duration_seconds is not None else 0.0, actual_cost, job_id),
-        )
-        conn.commit()
-    except Exception as e:
-        # Column duration_seconds might not exist yet; log and continue
-        logger.debug(f"settle_job: Could not update job duration/cost: {e}")
+        # Persist duration and actual cost on job
+        if db_has_duration_seconds():
+            conn.execute(
+                SQL_SETTLE_JOB,
+                (duration_seconds if duration_seconds is not None else 0.0, actual_cost, job_id),
+            )
+        else:
+            conn.execute(SQL_SETTLE_JOB_LEGACY, (actual_cost, job_id))
+        db_invalidate_job_cache(job_id)
 
 
 # ----- Backward compatibility for callers that expect fixed cost/reward -----
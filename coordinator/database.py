@@ -10,11 +10,13 @@ FIXES APPLIED:
 """
 
 import sqlite3
+import json
 import logging
 import time
 from contextlib import contextmanager
-from typing import Optional, Dict, Any, List
-from threading import Lock
+from functools import lru_cache, wraps
+from typing import Optional, Dict, Any, Callable, Iterator, List, Tuple, Union
+from threading import Lock, RLock, local
 
 # Import from common
 import sys
@@ -29,6 +31,173 @@ logger = logging.getLogger(__name__)
 # Global database connection and lock
 _db_conn: Optional[sqlite3.Connection] = None
 _db_lock = Lock()
+# Per-thread connections for DB work run off the event loop (see get_thread_db);
+# each is opened once per executor thread and reused, and tracked for close_db()
+_thread_db = local()
+_thread_conns: List[sqlite3.Connection] = []
+
+# Accepted values for the env-configurable PRAGMAs (PRAGMA values cannot be bound as parameters)
+_SQLITE_SYNC_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+_SQLITE_JOURNAL_MODES = {"WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"}
+
+
+class _TTLCache:
+    """Small thread-safe TTL cache for hot reads of rarely-changing rows.
+    
+    Writers must pop affected keys; the TTL only bounds staleness for
+    writes made outside this module.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data: Dict[Any, Tuple[float, Any]] = {}
+        self._lock = RLock()
+    
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+    
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            if key not in self._data and len(self._data) >= self._maxsize:
+                # Evict the oldest insertion
+                del self._data[next(iter(self._data))]
+            self._data[key] = (time.monotonic() + self._ttl, value)
+    
+    def pop(self, key: Any) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_MISSING = object()
+_read_cache = _TTLCache(maxsize=4096, ttl=5.0)
+_TERMINAL_JOB_STATUSES = ("completed", "failed")
+
+
+_json_dumps = json.dumps
+
+
+@lru_cache(maxsize=256)
+def _dumps_items(items: Tuple[Tuple[Any, Any], ...], types: Tuple[type, ...]) -> str:
+    # `types` is only part of the cache key: 1, 1.0 and True hash equal but encode differently
+    return _json_dumps(dict(items))
+
+
+# Only dicts whose keys and values are all of these exact types are memoized: the
+# per-part type tuple then fully describes the encoding (a nested tuple could
+# hide (1, True) == (1, 1) and share an entry)
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+def _dumps_json_dict(value: Any) -> str:
+    """json.dumps with memoization for flat dicts (limits/caps repeat across jobs and workers)"""
+    if isinstance(value, dict):
+        items = tuple(value.items())
+        types = tuple(type(part) for item in items for part in item)
+        if _SCALAR_TYPES.issuperset(types):
+            return _dumps_items(items, types)
+    return _json_dumps(value)
+
+
+# Coalesced worker status/heartbeat writes: worker_id -> (status or None for heartbeat-only,
+# heartbeat ts or None for status-only). Drained by db_flush_worker_status(); reads overlay
+# pending entries so they never see stale rows.
+_worker_status_buf: Dict[str, Tuple[Optional[str], Optional[float]]] = {}
+_worker_status_lock = Lock()
+
+
+def _supersede_pending_status(worker_id: str, keep_offline: bool = False) -> None:
+    """Called by direct status writers so a later flush cannot overwrite their status.
+
+    keep_offline: leave a pending "offline" in place, so it is re-applied by the
+    next flush (a release must not resurrect a worker that has disconnected).
+    """
+    with _worker_status_lock:
+        pending = _worker_status_buf.get(worker_id)
+        if pending is not None and pending[0] is not None:
+            if keep_offline and pending[0] == "offline":
+                return
+            if pending[1] is None:
+                del _worker_status_buf[worker_id]
+            else:
+                _worker_status_buf[worker_id] = (None, pending[1])
+
+
+def _overlay_pending_status(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a not-yet-flushed status/heartbeat to a worker row dict (in place)"""
+    pending = _worker_status_buf.get(row["id"])
+    if pending is not None:
+        status, ts = pending
+        if status is not None:
+            row["status"] = status
+        if ts is not None:
+            row["last_heartbeat"] = ts
+    return row
+
+
+def db_invalidate_job_cache(job_id: str) -> None:
+    """Drop a cached job row; call after any UPDATE of that job (finished rows are cached)"""
+    _read_cache.pop(("job", job_id))
+
+
+def db_invalidate_worker_cache(worker_id: str) -> None:
+    """Drop cached reads for a worker; call after writing its row outside this module"""
+    _read_cache.pop(("worker", worker_id))
+    _read_cache.pop(("worker_auth", worker_id))
+
+
+# Hot-path SQL (shared string objects keep sqlite3's statement cache warm)
+SQL_GET_JOB = "SELECT * FROM jobs WHERE id=?"
+SQL_GET_WORKER = "SELECT * FROM workers WHERE id=?"
+SQL_WORKER_HEARTBEAT = "UPDATE workers SET last_heartbeat=? WHERE id=?"
+SQL_SET_WORKER_STATUS = "UPDATE workers SET status=?, last_heartbeat=? WHERE id=?"
+SQL_SET_WORKER_OFFLINE = "UPDATE workers SET status=? WHERE id=?"
+SQL_SET_WORKER_BUSY = "UPDATE workers SET status='busy' WHERE id=?"
+SQL_RELEASE_WORKER = "UPDATE workers SET status='idle' WHERE id=?"
+SQL_RELEASE_WORKER_COUNTED = "UPDATE workers SET status='idle', jobs_completed=jobs_completed+1 WHERE id=?"
+# Guarded on status so a job is only ever assigned once
+SQL_ASSIGN_JOB = "UPDATE jobs SET worker_id=?, status='running', started_at=? WHERE id=? AND status='queued'"
+SQL_REQUEUE_JOB = "UPDATE jobs SET status='queued', worker_id=NULL WHERE id=?"
+# Requeue only if the job is still running on the given worker (watchdog, undelivered assignments)
+SQL_REQUEUE_STALE_JOB = (
+    "UPDATE jobs SET status='queued', worker_id=NULL WHERE id=? AND status='running' AND worker_id=?"
+)
+SQL_COMPLETE_JOB = "UPDATE jobs SET status=?, completed_at=?, stdout=?, stderr=?, exit_code=? WHERE id=?"
+SQL_COMPLETE_JOB_RETURNING_WORKER = SQL_COMPLETE_JOB + " RETURNING worker_id"
+
+# Column whitelist for caller-selected projections, and the default for job listings
+JOB_COLUMNS = frozenset((
+    "id", "user_id", "code", "language", "status", "worker_id", "created_at",
+    "started_at", "completed_at", "stdout", "stderr", "exit_code", "limits",
+    "cost", "duration_seconds", "priority",
+))
+JOB_SUMMARY_COLUMNS = (
+    "id", "user_id", "language", "status", "worker_id", "created_at",
+    "started_at", "completed_at", "exit_code", "cost", "duration_seconds",
+)
+WORKER_COLUMNS = frozenset((
+    "id", "owner_id", "ip", "caps", "status", "auth_token", "last_heartbeat",
+    "registered_at", "jobs_completed", "credits_earned",
+))
+# Everything a listing displays; auth_token is never sent out
+WORKER_SUMMARY_COLUMNS = (
+    "id", "owner_id", "ip", "caps", "status", "last_heartbeat",
+    "registered_at", "jobs_completed", "credits_earned",
+)
+
+# UPDATE ... RETURNING needs SQLite 3.35+
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Set by init_db() once the jobs.duration_seconds migration is confirmed
+_HAS_DURATION_SECONDS = False
 
 
 def get_db_path() -> str:
@@ -40,35 +209,126 @@ def get_db() -> sqlite3.Connection:
     """Get or create database connection (thread-safe)"""
     global _db_conn
     
+    # Fast path: the connection is created once, so skip the lock after that
+    conn = _db_conn
+    if conn is not None:
+        return conn
+    
     with _db_lock:
         if _db_conn is None:
-            db_path = get_db_path()
-            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
-            
-            _db_conn = sqlite3.connect(
-                db_path,
-                check_same_thread=False,
-                timeout=30.0
-            )
-            _db_conn.row_factory = sqlite3.Row
-            
-            logger.info(f"Database connected: {db_path}")
+            _db_conn = _connect()
         
         return _db_conn
 
 
+def get_thread_db() -> sqlite3.Connection:
+    """
+    Connection owned by the calling thread, for DB work moved off the event
+    loop with asyncio.to_thread(). WAL lets it read alongside the shared
+    connection; writes serialize on BEGIN IMMEDIATE + busy_timeout. Never
+    use it on the event loop thread (use get_db() there).
+    """
+    conn = getattr(_thread_db, "conn", None)
+    if conn is None:
+        conn = _thread_db.conn = _connect()
+        with _db_lock:
+            _thread_conns.append(conn)
+    return conn
+
+
+def close_db() -> None:
+    """
+    Close every connection opened by this module (call once at shutdown, after
+    the last flush). The shared connection closes last, so SQLite checkpoints
+    the WAL and removes the -wal/-shm files.
+    """
+    global _db_conn
+    with _db_lock:
+        conns = _thread_conns[:]
+        _thread_conns.clear()
+        if _db_conn is not None:
+            conns.append(_db_conn)
+            _db_conn = None
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to close database connection: {e}")
+
+
+def _connect() -> sqlite3.Connection:
+    db_path = get_db_path()
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    
+    # isolation_level=None: no implicit BEGIN DEFERRED before DML; single
+    # statements autocommit and db_transaction() opens BEGIN IMMEDIATE itself
+    conn = sqlite3.connect(
+        db_path,
+        check_same_thread=False,
+        timeout=30.0,
+        isolation_level=None,
+        cached_statements=256,
+    )
+    conn.row_factory = sqlite3.Row
+    _configure_connection(conn)
+    
+    logger.info(f"Database connected: {db_path}")
+    return conn
+
+
+def _configure_connection(conn: sqlite3.Connection) -> None:
+    """
+    Apply performance PRAGMAs.
+    
+    WAL lets readers run alongside the single writer, and synchronous=NORMAL
+    skips the per-commit fsync (WAL stays consistent; only the last commits
+    can be lost on power failure). Override with GRIDX_SQLITE_JOURNAL_MODE /
+    GRIDX_SQLITE_SYNC, e.g. GRIDX_SQLITE_SYNC=OFF for throwaway dev databases.
+    """
+    journal_mode = os.getenv("GRIDX_SQLITE_JOURNAL_MODE", "WAL").upper()
+    if journal_mode not in _SQLITE_JOURNAL_MODES:
+        logger.warning(f"Ignoring invalid GRIDX_SQLITE_JOURNAL_MODE={journal_mode}, using WAL")
+        journal_mode = "WAL"
+    sync_mode = os.getenv("GRIDX_SQLITE_SYNC", "NORMAL").upper()
+    if sync_mode not in _SQLITE_SYNC_MODES:
+        logger.warning(f"Ignoring invalid GRIDX_SQLITE_SYNC={sync_mode}, using NORMAL")
+        sync_mode = "NORMAL"
+    
+    # journal_mode reports the mode actually in effect (WAL is refused on some filesystems)
+    active_mode = conn.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()[0]
+    conn.execute(f"PRAGMA synchronous={sync_mode}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB
+    conn.execute("PRAGMA busy_timeout=30000")
+    
+    if active_mode.upper() != journal_mode:
+        logger.warning(f"SQLite journal_mode={journal_mode} not accepted, using {active_mode}")
+    logger.info(f"SQLite journal_mode={active_mode}, synchronous={sync_mode}")
+
+
 @contextmanager
-def db_transaction():
+def db_transaction(conn: Optional[sqlite3.Connection] = None):
     """
     Database transaction context manager.
     
+    Takes the write lock up front (BEGIN IMMEDIATE) so concurrent writers wait
+    on busy_timeout instead of failing a DEFERRED -> RESERVED lock upgrade.
+    Nested use joins the enclosing transaction. Uses the shared connection
+    unless `conn` is given (e.g. get_thread_db()).
+    
     Usage:
         with db_transaction() as conn:
             conn.execute("INSERT ...")
             conn.execute("UPDATE ...")
             # Auto-commits on success, rolls back on exception
     """
-    conn = get_db()
+    if conn is None:
+        conn = get_db()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
     try:
         yield conn
         conn.commit()
@@ -98,7 +358,8 @@ def init_db() -> None:
             stderr TEXT DEFAULT '',
             exit_code INTEGER,
             limits TEXT,
-            cost REAL DEFAULT 1.0
+            cost REAL DEFAULT 1.0,
+            priority INTEGER NOT NULL DEFAULT 0
         )
     """)
     
@@ -140,26 +401,43 @@ def init_db() -> None:
     
     # Indices for performance
     conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_worker ON jobs(worker_id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_workers_owner ON workers(owner_id)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_workers_status ON workers(status)")
+    # Compound indices serve status scans in created_at / last_heartbeat order without a sort;
+    # they also cover plain status lookups, so the single-column ones are dropped
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_workers_status_heartbeat ON workers(status, last_heartbeat)")
+    conn.execute("DROP INDEX IF EXISTS idx_jobs_status")
+    conn.execute("DROP INDEX IF EXISTS idx_workers_status")
 
     # Migration: add duration_seconds to jobs (time-based credits)
+    global _HAS_DURATION_SECONDS
     try:
         cur = conn.execute("PRAGMA table_info(jobs)")
         cols = [r[1] for r in cur.fetchall()]
         if "duration_seconds" not in cols:
             conn.execute("ALTER TABLE jobs ADD COLUMN duration_seconds REAL")
-            conn.commit()
             logger.info("Added duration_seconds to jobs")
+        _HAS_DURATION_SECONDS = True
     except Exception as e:
         logger.debug(f"Migration duration_seconds: {e}")
     
-    conn.commit()
+    # Migration: add priority to jobs (kept across watchdog requeues)
+    try:
+        if "priority" not in cols:
+            conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            logger.info("Added priority to jobs")
+    except Exception as e:
+        logger.debug(f"Migration priority: {e}")
+    
     logger.info("Database schema initialized")
 
 
+def db_has_duration_seconds() -> bool:
+    """True once init_db() has confirmed the jobs.duration_seconds column exists"""
+    return _HAS_DURATION_SECONDS
+
+
 # ============================================================================
 # JOB OPERATIONS
 # ============================================================================
@@ -171,22 +449,22 @@ def db_create_job(
     language: str,
     limits: Dict[str, Any],
     reserved_cost: float = 1.0,
+    priority: int = 0,
 ) -> None:
-    """Create a new job in database. cost column stores reserved credits (refunded on settle)."""
-    import json
-    
+    """Create a new job in database. cost column stores reserved credits (refunded on settle).
+
+    code and user_id are stored as given: callers validate them first
+    (validate_code / validate_user_id), so there is no second copy here.
+    """
     # Validate inputs
     if not validate_uuid(job_id):
         raise ValueError(f"Invalid job_id: {job_id}")
     
-    code = sanitize_string(code, max_length=1_000_000)
-    user_id = sanitize_string(user_id, max_length=64)
-    
     conn = get_db()
     conn.execute(
         """
-        INSERT INTO jobs (id, user_id, code, language, status, created_at, limits, cost)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO jobs (id, user_id, code, language, status, created_at, limits, cost, priority)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             job_id,
@@ -195,40 +473,79 @@ def db_create_job(
             language,
             STATUS_QUEUED,
             now(),
-            json.dumps(limits),
+            _dumps_json_dict(limits),
             max(0.0, float(reserved_cost)),
+            priority,
         )
     )
-    conn.commit()
     logger.info(f"Job created: {job_id} by {user_id} (reserved={reserved_cost})")
 
 
-def db_get_job(job_id: str) -> Optional[Dict[str, Any]]:
+def row_to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    """Convert a row to a dict at the serialization boundary (getters return sqlite3.Row)"""
+    return dict(row) if row is not None else None
+
+
+def db_get_job(job_id: str) -> Optional[sqlite3.Row]:
     """Get job by ID"""
     if not validate_uuid(job_id):
         logger.warning(f"Invalid job_id format: {job_id}")
         return None
     
-    row = get_db().execute(
-        "SELECT * FROM jobs WHERE id=?",
-        (job_id,)
-    ).fetchone()
+    # Rows are immutable, so cached ones are shared as-is
+    cached = _read_cache.get(("job", job_id))
+    if cached is not None:
+        return cached
     
-    return dict(row) if row else None
+    row = get_db().execute(SQL_GET_JOB, (job_id,)).fetchone()
+    if not row:
+        return None
+    
+    # Only finished jobs are immutable, so only those are safe to cache
+    if row["status"] in _TERMINAL_JOB_STATUSES:
+        _read_cache.set(("job", job_id), row)
+    return row
+
+
+@lru_cache(maxsize=16)
+def _list_jobs_sql(columns: Optional[Tuple[str, ...]]) -> str:
+    if columns is None:
+        projection = "*"
+    else:
+        unknown = [c for c in columns if c not in JOB_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown job columns: {unknown}")
+        projection = ", ".join(columns)
+    return f"SELECT {projection} FROM jobs WHERE user_id=? ORDER BY created_at DESC LIMIT ?"
 
 
-def db_list_jobs_by_user(user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
-    """List jobs for a user, most recent first."""
+def db_list_jobs_by_user(
+    user_id: str,
+    limit: int = 50,
+    columns: Optional[Tuple[str, ...]] = JOB_SUMMARY_COLUMNS,
+) -> List[Dict[str, Any]]:
+    """List jobs for a user, most recent first.
+    
+    By default only summary columns are read (no code/stdout/stderr);
+    pass columns=None for full rows or use db_get_job() for one job.
+    """
     if not user_id:
         return []
     user_id = sanitize_string(user_id, max_length=64)
-    rows = get_db().execute(
-        "SELECT * FROM jobs WHERE user_id=? ORDER BY created_at DESC LIMIT ?",
-        (user_id, limit)
-    ).fetchall()
+    rows = get_db().execute(_list_jobs_sql(columns), (user_id, limit)).fetchall()
     return [dict(row) for row in rows]
 
 
+@lru_cache(maxsize=32)
+def _build_update_sql(keys: Tuple[str, ...]) -> str:
+    # Few kwargs shapes occur in practice; the same string object also hits sqlite3's statement cache
+    unknown = [k for k in keys if k not in JOB_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown job columns: {unknown}")
+    updates = ["status=?"] + [f"{k}=?" for k in keys]
+    return f"UPDATE jobs SET {', '.join(updates)} WHERE id=?"
+
+
 def db_update_job_status(
     job_id: str,
     status: str,
@@ -238,20 +555,14 @@ def db_update_job_status(
     if not validate_uuid(job_id):
         raise ValueError(f"Invalid job_id: {job_id}")
     
-    updates = ["status=?"]
+    keys = tuple(sorted(kwargs))
     params = [status]
-    
-    for key, value in kwargs.items():
-        updates.append(f"{key}=?")
-        params.append(value)
-    
+    params.extend(kwargs[key] for key in keys)
     params.append(job_id)
     
-    query = f"UPDATE jobs SET {', '.join(updates)} WHERE id=?"
-    
     conn = get_db()
-    conn.execute(query, params)
-    conn.commit()
+    conn.execute(_build_update_sql(keys), params)
+    db_invalidate_job_cache(job_id)
     
     logger.info(f"Job {job_id} updated: status={status}")
 
@@ -269,51 +580,166 @@ def db_upsert_worker(
     auth_token: str = ""
 ) -> None:
     """Insert or update worker. If auth_token provided, also register user credentials."""
-    import json
-    
     if not validate_uuid(worker_id):
         raise ValueError(f"Invalid worker_id: {worker_id}")
     
-    conn = get_db()
-    conn.execute(
-        """
-        INSERT INTO workers (id, owner_id, ip, caps, status, registered_at, last_heartbeat)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET
-            ip=excluded.ip,
-            caps=excluded.caps,
-            status=excluded.status,
-            last_heartbeat=excluded.last_heartbeat
-        """,
-        (worker_id, owner_id, ip, json.dumps(caps), status, now(), now())
-    )
-    
-    # If auth_token provided, register or update user credentials in user_auth table
-    if auth_token and owner_id:
-        db_register_user_auth(owner_id, auth_token)
+    # One timestamp so a new row gets registered_at == last_heartbeat
+    ts = now()
+    register_auth = bool(auth_token and owner_id)
+    # Worker row and owner credentials commit together (or not at all)
+    with db_transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO workers (id, owner_id, ip, caps, status, registered_at, last_heartbeat)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                ip=excluded.ip,
+                caps=excluded.caps,
+                status=excluded.status,
+                last_heartbeat=excluded.last_heartbeat
+            """,
+            (worker_id, owner_id, ip, _dumps_json_dict(caps), status, ts, ts)
+        )
+        
+        # If auth_token provided, register or update user credentials in user_auth table
+        if register_auth:
+            _register_user_auth_nocommit(conn, owner_id, auth_token)
     
-    conn.commit()
+    if register_auth:
+        _read_cache.pop(("user_auth", owner_id))
+        logger.info(f"User credentials registered: {owner_id}")
+    _supersede_pending_status(worker_id)
+    db_invalidate_worker_cache(worker_id)
     logger.info(f"Worker upserted: {worker_id}")
 
 
-def db_list_workers() -> List[Dict[str, Any]]:
-    """List all workers"""
-    rows = get_db().execute("SELECT * FROM workers").fetchall()
-    return [dict(row) for row in rows]
+@lru_cache(maxsize=16)
+def _list_workers_sql(columns: Tuple[str, ...], by_status: bool, by_since: bool) -> str:
+    unknown = [c for c in columns if c not in WORKER_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown worker columns: {unknown}")
+    where = []
+    if by_status:
+        where.append("status=?")
+    if by_since:
+        where.append("last_heartbeat>=?")
+    clause = f" WHERE {' AND '.join(where)}" if where else ""
+    return f"SELECT {', '.join(columns)} FROM workers{clause} LIMIT ?"
+
+
+def db_list_workers(
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    limit: Optional[int] = None,
+    columns: Tuple[str, ...] = WORKER_SUMMARY_COLUMNS,
+) -> Iterator[sqlite3.Row]:
+    """Iterate workers, optionally only those with `status` and/or a heartbeat at or after `since`.
+    
+    Filters run in SQL (idx_workers_status_heartbeat); rows stream from the cursor.
+    limit=None means no limit.
+    """
+    # Buffered status/heartbeat updates must be visible to the filters
+    db_flush_worker_status()
+    params: List[Any] = []
+    if status is not None:
+        params.append(status)
+    if since is not None:
+        params.append(since)
+    # SQLite treats a negative LIMIT as no limit; only None may mean that
+    params.append(-1 if limit is None else max(0, limit))
+    sql = _list_workers_sql(columns, status is not None, since is not None)
+    return get_db().execute(sql, params)
+
 
+SQL_WORKER_STATUS_COUNTS = "SELECT status, COUNT(*) FROM workers GROUP BY status"
 
-def db_get_worker(worker_id: str) -> Optional[Dict[str, Any]]:
-    """Get worker by ID"""
+
+def db_worker_status_counts() -> Dict[str, int]:
+    """Number of workers per status (aggregated in SQL off idx_workers_status_heartbeat)"""
+    db_flush_worker_status()
+    return dict(get_db().execute(SQL_WORKER_STATUS_COUNTS).fetchall())
+
+
+def db_get_worker(worker_id: str) -> Optional[Union[sqlite3.Row, Dict[str, Any]]]:
+    """Get worker by ID (a dict instead of the row while a status update is still buffered)"""
     if not validate_uuid(worker_id):
         logger.warning(f"Invalid worker_id format: {worker_id}")
         return None
     
-    row = get_db().execute(
-        "SELECT * FROM workers WHERE id=?",
-        (worker_id,)
-    ).fetchone()
+    key = ("worker", worker_id)
+    cached = _read_cache.get(key, _MISSING)
+    if cached is _MISSING:
+        cached = get_db().execute(SQL_GET_WORKER, (worker_id,)).fetchone()
+        _read_cache.set(key, cached)
     
-    return dict(row) if row else None
+    if cached is None:
+        return None
+    if worker_id in _worker_status_buf:
+        return _overlay_pending_status(dict(cached))
+    return cached
+
+
+def db_bulk_heartbeat(worker_ids: List[str]) -> None:
+    """Refresh last_heartbeat for many workers with one executemany and one commit"""
+    if not worker_ids:
+        return
+    ts = now()
+    with db_transaction() as conn:
+        conn.executemany(SQL_WORKER_HEARTBEAT, [(ts, worker_id) for worker_id in worker_ids])
+    for worker_id in worker_ids:
+        db_invalidate_worker_cache(worker_id)
+
+
+def db_touch_worker(worker_id: str) -> float:
+    """
+    Record a worker heartbeat without a write; it is persisted by the next
+    db_flush_worker_status(). Returns the heartbeat timestamp.
+    """
+    ts = now()
+    with _worker_status_lock:
+        pending = _worker_status_buf.get(worker_id)
+        _worker_status_buf[worker_id] = (pending[0] if pending is not None else None, ts)
+    return ts
+
+
+def db_flush_worker_status() -> int:
+    """
+    Persist buffered worker status/heartbeat updates in one transaction.
+    Returns the number of workers written.
+    """
+    with _worker_status_lock:
+        if not _worker_status_buf:
+            return 0
+        pending = list(_worker_status_buf.items())
+        _worker_status_buf.clear()
+    
+    status_rows = []
+    status_only_rows = []
+    heartbeat_rows = []
+    for worker_id, (status, ts) in pending:
+        if status is None:
+            heartbeat_rows.append((ts, worker_id))
+        elif ts is None:
+            status_only_rows.append((status, worker_id))
+        else:
+            status_rows.append((status, ts, worker_id))
+    try:
+        with db_transaction() as conn:
+            if status_rows:
+                conn.executemany(SQL_SET_WORKER_STATUS, status_rows)
+            if status_only_rows:
+                conn.executemany(SQL_SET_WORKER_OFFLINE, status_only_rows)
+            if heartbeat_rows:
+                conn.executemany(SQL_WORKER_HEARTBEAT, heartbeat_rows)
+    except Exception:
+        # Put the batch back unless newer entries arrived meanwhile
+        with _worker_status_lock:
+            for worker_id, entry in pending:
+                _worker_status_buf.setdefault(worker_id, entry)
+        raise
+    for worker_id, _ in pending:
+        db_invalidate_worker_cache(worker_id)
+    return len(pending)
 
 
 # ============================================================================
@@ -327,30 +753,15 @@ def db_assign_job_to_worker(job_id: str, worker_id: str) -> bool:
     """
     try:
         with db_transaction() as conn:
-            # Check if job is still queued
-            job = conn.execute(
-                "SELECT status FROM jobs WHERE id=?",
-                (job_id,)
-            ).fetchone()
-            
-            if not job or job['status'] != STATUS_QUEUED:
+            # Update job only if it is still queued (no separate status SELECT)
+            cur = conn.execute(SQL_ASSIGN_JOB, (worker_id, now(), job_id))
+            if cur.rowcount == 0:
                 return False
             
-            # Update job
-            conn.execute(
-                """
-                UPDATE jobs 
-                SET worker_id=?, status='running', started_at=?
-                WHERE id=? AND status='queued'
-                """,
-                (worker_id, now(), job_id)
-            )
-            
             # Update worker
-            conn.execute(
-                "UPDATE workers SET status='busy' WHERE id=?",
-                (worker_id,)
-            )
+            conn.execute(SQL_SET_WORKER_BUSY, (worker_id,))
+            _supersede_pending_status(worker_id)
+            db_invalidate_worker_cache(worker_id)
             
             logger.info(f"Job {job_id} assigned to worker {worker_id}")
             return True
@@ -360,6 +771,31 @@ def db_assign_job_to_worker(job_id: str, worker_id: str) -> bool:
         return False
 
 
+def db_revert_assignment(job_id: str, worker_id: str, release_worker: bool = True) -> bool:
+    """Undo a dispatch that never reached the worker: requeue the job and idle the worker atomically.
+
+    The job is only requeued while it is still running on `worker_id`;
+    release_worker=False leaves the worker row alone (its connection was
+    replaced and may be busy with another job). Returns True if requeued.
+    """
+    with db_transaction() as conn:
+        requeued = conn.execute(SQL_REQUEUE_STALE_JOB, (job_id, worker_id)).rowcount == 1
+        if release_worker:
+            conn.execute(SQL_RELEASE_WORKER, (worker_id,))
+    db_invalidate_job_cache(job_id)
+    if release_worker:
+        _supersede_pending_status(worker_id, keep_offline=True)
+        db_invalidate_worker_cache(worker_id)
+    return requeued
+
+
+def _release_worker_nocommit(conn: sqlite3.Connection, worker_id: str, succeeded: bool) -> None:
+    """Mark worker idle (counting the job if it succeeded); caller owns the transaction"""
+    conn.execute(SQL_RELEASE_WORKER_COUNTED if succeeded else SQL_RELEASE_WORKER, (worker_id,))
+    _supersede_pending_status(worker_id, keep_offline=True)
+    db_invalidate_worker_cache(worker_id)
+
+
 def db_complete_job(
     job_id: str,
     worker_id: str,
@@ -373,30 +809,10 @@ def db_complete_job(
             status = "completed" if exit_code == 0 else "failed"
             
             # Update job
-            conn.execute(
-                """
-                UPDATE jobs
-                SET status=?, completed_at=?, stdout=?, stderr=?, exit_code=?
-                WHERE id=?
-                """,
-                (status, now(), stdout, stderr, exit_code, job_id)
-            )
+            conn.execute(SQL_COMPLETE_JOB, (status, now(), stdout, stderr, exit_code, job_id))
+            db_invalidate_job_cache(job_id)
             
-            # Update worker stats
-            if exit_code == 0:
-                conn.execute(
-                    """
-                    UPDATE workers
-                    SET status='idle', jobs_completed=jobs_completed+1
-                    WHERE id=?
-                    """,
-                    (worker_id,)
-                )
-            else:
-                conn.execute(
-                    "UPDATE workers SET status='idle' WHERE id=?",
-                    (worker_id,)
-                )
+            _release_worker_nocommit(conn, worker_id, exit_code == 0)
             
             logger.info(f"Job {job_id} completed with exit code {exit_code}")
             return True
@@ -410,166 +826,171 @@ def db_complete_job(
 # ============================================================================
 
 
+def _log_and_swallow(default: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Compat wrappers never raise: log the error and return `default` instead"""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"{fn.__name__} failed: {e}")
+                return default
+        return wrapper
+    return decorator
+
+@_log_and_swallow(False)
 def db_set_job_assigned(job_id: str, worker_id: str) -> bool:
     """Compatibility wrapper for older API name.
     Atomically assigns a job to a worker.
     """
-    try:
-        if not validate_uuid(job_id) or not validate_uuid(worker_id):
-            logger.warning("Invalid job_id or worker_id in db_set_job_assigned")
-            return False
-        return db_assign_job_to_worker(job_id, worker_id)
-    except Exception as e:
-        logger.error(f"db_set_job_assigned failed: {e}")
+    if not validate_uuid(job_id) or not validate_uuid(worker_id):
+        logger.warning("Invalid job_id or worker_id in db_set_job_assigned")
         return False
+    return db_assign_job_to_worker(job_id, worker_id)
 
 
+@_log_and_swallow(None)
 def db_set_job_running(job_id: str) -> None:
     """Mark job as running (compat wrapper)."""
-    try:
-        if not validate_uuid(job_id):
-            logger.warning("Invalid job_id in db_set_job_running")
-            return
-        db_update_job_status(job_id, "running", started_at=now())
-    except Exception as e:
-        logger.error(f"db_set_job_running failed: {e}")
+    if not validate_uuid(job_id):
+        logger.warning("Invalid job_id in db_set_job_running")
+        return
+    db_update_job_status(job_id, "running", started_at=now())
 
 
+@_log_and_swallow(False)
 def db_set_job_completed(job_id: str, stdout: str, stderr: str, exit_code: int) -> bool:
     """Compatibility wrapper to complete a job using available APIs.
 
-    If worker_id is recorded for the job, uses the atomic completion routine,
-    otherwise updates the job row directly.
+    Updates the job row and, if a worker_id is recorded for the job, releases
+    that worker in the same transaction. The UPDATE returns worker_id, so no
+    separate lookup is needed.
     """
-    try:
-        if not validate_uuid(job_id):
-            logger.warning("Invalid job_id in db_set_job_completed")
-            return False
+    if not validate_uuid(job_id):
+        logger.warning("Invalid job_id in db_set_job_completed")
+        return False
 
-        row = get_db().execute("SELECT worker_id FROM jobs WHERE id=?", (job_id,)).fetchone()
+    status = "completed" if exit_code == 0 else "failed"
+    params = (status, now(), stdout, stderr, exit_code, job_id)
+    with db_transaction() as conn:
+        if SQLITE_HAS_RETURNING:
+            row = conn.execute(SQL_COMPLETE_JOB_RETURNING_WORKER, params).fetchone()
+        else:
+            row = conn.execute("SELECT worker_id FROM jobs WHERE id=?", (job_id,)).fetchone()
+            conn.execute(SQL_COMPLETE_JOB, params)
+        # A repeated result rewrites an already finished (cached) row
+        db_invalidate_job_cache(job_id)
         worker_id = row["worker_id"] if row else None
 
         if worker_id and validate_uuid(worker_id):
-            return db_complete_job(job_id, worker_id, stdout, stderr, exit_code)
-
-        # Fallback: update job row only
-        status = "completed" if exit_code == 0 else "failed"
-        conn = get_db()
-        conn.execute(
-            """
-            UPDATE jobs
-            SET status=?, completed_at=?, stdout=?, stderr=?, exit_code=?
-            WHERE id=?
-            """,
-            (status, now(), stdout, stderr, exit_code, job_id),
-        )
-        conn.commit()
-        logger.info(f"Job {job_id} marked {status} (fallback)")
-        return True
-    except Exception as e:
-        logger.error(f"db_set_job_completed failed: {e}")
-        return False
+            _release_worker_nocommit(conn, worker_id, exit_code == 0)
+            logger.info(f"Job {job_id} completed with exit code {exit_code}")
+        else:
+            logger.info(f"Job {job_id} marked {status} (no worker recorded)")
+    return True
 
 
+@_log_and_swallow(None)
 def db_set_worker_status(worker_id: str, status: str) -> None:
-    """Set worker status (compat wrapper)."""
-    try:
-        if not validate_uuid(worker_id):
-            logger.warning("Invalid worker_id in db_set_worker_status")
-            return
-        conn = get_db()
-        # Update status and refresh last_heartbeat to mark worker as recently seen
-        conn.execute("UPDATE workers SET status=?, last_heartbeat=? WHERE id=?", (status, now(), worker_id))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"db_set_worker_status failed: {e}")
+    """Set worker status (compat wrapper). Buffered; see db_flush_worker_status()."""
+    if not validate_uuid(worker_id):
+        logger.warning("Invalid worker_id in db_set_worker_status")
+        return
+    # Update status and refresh last_heartbeat to mark worker as recently seen
+    ts = now()
+    with _worker_status_lock:
+        _worker_status_buf[worker_id] = (status, ts)
 
 
+@_log_and_swallow(None)
 def db_init() -> None:
     """Compatibility alias for init_db."""
-    try:
-        init_db()
-    except Exception as e:
-        logger.error(f"db_init failed: {e}")
+    init_db()
 
 
+@_log_and_swallow(None)
 def db_set_worker_offline(worker_id: str) -> None:
-    """Mark a worker offline (compat wrapper)."""
-    try:
-        if not validate_uuid(worker_id):
-            logger.warning("Invalid worker_id in db_set_worker_offline")
-            return
-        conn = get_db()
-        conn.execute("UPDATE workers SET status=? WHERE id=?", ("offline", worker_id))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"db_set_worker_offline failed: {e}")
+    """Mark a worker offline (compat wrapper).
+
+    Buffered like db_set_worker_status() so a disconnect never commits inline,
+    but last_heartbeat is left alone (a pending heartbeat is still written).
+    """
+    if not validate_uuid(worker_id):
+        logger.warning("Invalid worker_id in db_set_worker_offline")
+        return
+    with _worker_status_lock:
+        pending = _worker_status_buf.get(worker_id)
+        _worker_status_buf[worker_id] = ("offline", pending[1] if pending is not None else None)
 
 
+@_log_and_swallow(None)
 def db_get_worker_by_auth(owner_id: str, auth_token: str) -> Optional[Dict[str, Any]]:
     """Return a worker row for given owner credentials, if any."""
-    try:
-        if not owner_id:
-            return None
-        row = get_db().execute(
-            "SELECT * FROM workers WHERE owner_id=? AND auth_token=?",
-            (owner_id, auth_token),
-        ).fetchone()
-        return dict(row) if row else None
-    except Exception as e:
-        logger.error(f"db_get_worker_by_auth failed: {e}")
+    if not owner_id:
         return None
+    row = get_db().execute(
+        "SELECT * FROM workers WHERE owner_id=? AND auth_token=?",
+        (owner_id, auth_token),
+    ).fetchone()
+    return dict(row) if row else None
 
 
+@_log_and_swallow(False)
 def db_verify_worker_auth(worker_id: str, auth_token: str) -> bool:
     """Verify that a worker id matches the provided auth token."""
-    try:
-        if not validate_uuid(worker_id):
-            return False
+    if not validate_uuid(worker_id):
+        return False
+    key = ("worker_auth", worker_id)
+    stored = _read_cache.get(key, _MISSING)
+    if stored is _MISSING:
         row = get_db().execute(
             "SELECT auth_token FROM workers WHERE id=?",
             (worker_id,),
         ).fetchone()
-        return bool(row and row["auth_token"] == auth_token)
-    except Exception as e:
-        logger.error(f"db_verify_worker_auth failed: {e}")
-        return False
+        # Cache as a 1-tuple so "no row" stays distinct from a NULL token
+        stored = (row["auth_token"],) if row else None
+        _read_cache.set(key, stored)
+    return bool(stored and stored[0] == auth_token)
+
+
+def _register_user_auth_nocommit(conn: sqlite3.Connection, user_id: str, auth_token: str) -> None:
+    """Upsert user credentials; caller owns the transaction"""
+    conn.execute(
+        """
+        INSERT INTO user_auth (user_id, auth_token, created_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            auth_token=excluded.auth_token
+        """,
+        (user_id, auth_token, now())
+    )
 
 
+@_log_and_swallow(False)
 def db_register_user_auth(user_id: str, auth_token: str) -> bool:
     """Register or update user credentials in user_auth table."""
-    try:
-        if not user_id or not auth_token:
-            return False
-        conn = get_db()
-        conn.execute(
-            """
-            INSERT INTO user_auth (user_id, auth_token, created_at)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                auth_token=excluded.auth_token
-            """,
-            (user_id, auth_token, now())
-        )
-        conn.commit()
-        logger.info(f"User credentials registered: {user_id}")
-        return True
-    except Exception as e:
-        logger.error(f"db_register_user_auth failed: {e}")
+    if not user_id or not auth_token:
         return False
+    _register_user_auth_nocommit(get_db(), user_id, auth_token)
+    _read_cache.pop(("user_auth", user_id))
+    logger.info(f"User credentials registered: {user_id}")
+    return True
 
 
+@_log_and_swallow(False)
 def db_verify_user_auth(user_id: str, auth_token: str) -> bool:
     """Verify user credentials against `user_auth` table."""
-    try:
-        if not user_id:
-            return False
+    if not user_id:
+        return False
+    key = ("user_auth", user_id)
+    stored = _read_cache.get(key, _MISSING)
+    if stored is _MISSING:
         row = get_db().execute(
             "SELECT auth_token FROM user_auth WHERE user_id=?",
             (user_id,),
         ).fetchone()
-        return bool(row and row["auth_token"] == auth_token)
-    except Exception as e:
-        logger.error(f"db_verify_user_auth failed: {e}")
-
-        return False
+        # Cache as a 1-tuple so "no row" stays distinct from a NULL token
+        stored = (row["auth_token"],) if row else None
+        _read_cache.set(key, stored)
+    return bool(stored and stored[0] == auth_token)
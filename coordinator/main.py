@@ -21,9 +21,9 @@ from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi import WebSocket
-from coordinator.websocket import worker_ws
+from coordinator.websocket import worker_ws, forget_hello_sig
 
 # Import from common module (now properly implemented)
 import sys
@@ -32,6 +32,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from common.utils import (
     validate_uuid,
     validate_user_id,
+    validate_code,
     sanitize_string,
     now,
     generate_job_id
@@ -39,29 +40,50 @@ from common.utils import (
 from common.constants import (
     STATUS_QUEUED,
     DEFAULT_LANGUAGE,
+    SUPPORTED_LANGUAGES,
     HTTP_BAD_REQUEST,
     HTTP_NOT_FOUND,
     HTTP_PAYMENT_REQUIRED,
-    HTTP_INTERNAL_ERROR
+    HTTP_INTERNAL_ERROR,
+    HTTP_SERVICE_UNAVAILABLE,
+    MAX_CODE_LENGTH,
+    DEFAULT_JOB_PRIORITY,
+    MIN_JOB_PRIORITY,
+    MAX_JOB_PRIORITY,
 )
 
 from coordinator.database import (
     db_get_job,
+    row_to_dict,
     db_list_jobs_by_user,
     db_list_workers,
-    get_db,
+    db_worker_status_counts,
     db_create_job,
     db_upsert_worker,
-    init_db
+    init_db,
+    db_touch_worker,
+    db_flush_worker_status,
+    close_db,
+    JOB_SUMMARY_COLUMNS,
+    WORKER_SUMMARY_COLUMNS,
 )
 from coordinator.credit_manager import (
     ensure_user,
-    get_balance,
-    deduct,
+    deduct_returning,
     credit,
     get_max_reserve,
 )
-from coordinator.scheduler import job_queue, dispatch, watchdog_loop
+from coordinator.scheduler import (
+    job_queue,
+    enqueue_job,
+    queue_is_full,
+    request_dispatch,
+    dispatcher_loop,
+    watchdog_loop,
+    worker_status_flush_loop,
+    job_output_cleanup_loop,
+    flush_job_results,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -78,8 +100,21 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
-    asyncio.create_task(watchdog_loop())
+    tasks = [
+        asyncio.create_task(dispatcher_loop()),
+        asyncio.create_task(watchdog_loop()),
+        asyncio.create_task(worker_status_flush_loop()),
+        asyncio.create_task(job_output_cleanup_loop()),
+    ]
     yield
+    # Stop the background loops first: once close_db() has run, any of them
+    # waking up would silently reopen a connection
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    flush_job_results()
+    db_flush_worker_status()
+    close_db()
 
 
 # ============================================================================
@@ -140,8 +175,8 @@ async def general_exception_handler(request: Request, exc: Exception):
 # JOB ENDPOINTS
 # ============================================================================
 
-@app.post("/jobs")
-async def submit_job(body: Dict[str, Any]) -> Dict[str, Any]:
+@app.post("/jobs", response_class=ORJSONResponse)
+async def submit_job(body: Dict[str, Any]) -> ORJSONResponse:
     """
     Submit code to run. Requires sufficient credits (tokens).
     
@@ -152,7 +187,8 @@ async def submit_job(body: Dict[str, Any]) -> Dict[str, Any]:
     {
         "user_id": "alice",
         "code": "print('hello world')",
-        "language": "python"
+        "language": "python",
+        "priority": 0           (optional, -10..10, lower runs first)
     }
     
     Returns:
@@ -162,24 +198,31 @@ async def submit_job(body: Dict[str, Any]) -> Dict[str, Any]:
     """
     # ========== INPUT VALIDATION ==========
     code = body.get("code")
-    if not code or not isinstance(code, str):
-        raise HTTPException(HTTP_BAD_REQUEST, "Missing or invalid 'code' field")
-    
-    if len(code) > 1_000_000:  # 1MB limit
-        raise HTTPException(HTTP_BAD_REQUEST, "Code exceeds maximum size of 1MB")
+    # Type, size (1MB) and NUL checks in one pass
+    code_ok, code_error = validate_code(code, max_length=MAX_CODE_LENGTH)
+    if not code_ok:
+        raise HTTPException(HTTP_BAD_REQUEST, code_error)
     
     language = body.get("language", DEFAULT_LANGUAGE)
-    if language not in ["python", "javascript", "node", "bash"]:
+    # isinstance first: an unhashable language (list/dict) must be a 400, not a TypeError
+    if not isinstance(language, str) or language not in SUPPORTED_LANGUAGES:
         raise HTTPException(HTTP_BAD_REQUEST, f"Unsupported language: {language}")
 
     user_id = body.get("user_id", "demo")
     if not validate_user_id(user_id):
         raise HTTPException(HTTP_BAD_REQUEST, f"Invalid user_id: {user_id}")
     
-    # Sanitize inputs
-    code = sanitize_string(code, max_length=1_000_000)
-    user_id = sanitize_string(user_id, max_length=64)
-
+    priority = body.get("priority", DEFAULT_JOB_PRIORITY)
+    # bool is an int subclass; reject it along with non-integers
+    if (
+        not isinstance(priority, int) or isinstance(priority, bool)
+        or not MIN_JOB_PRIORITY <= priority <= MAX_JOB_PRIORITY
+    ):
+        raise HTTPException(
+            HTTP_BAD_REQUEST,
+            f"Invalid priority: must be an integer from {MIN_JOB_PRIORITY} to {MAX_JOB_PRIORITY}",
+        )
+    
     # Time-based credits: reserve max cost from job timeout (refund unused when job completes)
     limits = body.get("limits") or {}
     timeout_seconds = limits.get("timeout_s") or 60
@@ -189,20 +232,20 @@ async def submit_job(body: Dict[str, Any]) -> Dict[str, Any]:
         timeout_seconds = 60
     reserved = get_max_reserve(timeout_seconds)
     
-    # ========== CREDIT HANDLING ==========
-    ensure_user(user_id)
-    current_balance = get_balance(user_id)
-    if current_balance < reserved:
-        raise HTTPException(
-            HTTP_PAYMENT_REQUIRED,
-            f"Insufficient credits. Reserve required: {reserved} (based on timeout), have {current_balance}"
-        )
+    # Backpressure: refuse before charging anything (nothing to refund)
+    if queue_is_full():
+        raise HTTPException(HTTP_SERVICE_UNAVAILABLE, "Job queue is full, retry later")
     
-    if not deduct(user_id, reserved):
-        raise HTTPException(
-            HTTP_PAYMENT_REQUIRED,
-            f"Failed to deduct credits. Balance: {get_balance(user_id)}"
-        )
+    # ========== CREDIT HANDLING ==========
+    # Check-and-deduct in one statement: no gap for a concurrent submit to double-spend.
+    # Existing users cost one round-trip; the account is only created on a miss.
+    if deduct_returning(user_id, reserved) is None:
+        balance = ensure_user(user_id)
+        if balance < reserved or deduct_returning(user_id, reserved) is None:
+            raise HTTPException(
+                HTTP_PAYMENT_REQUIRED,
+                f"Insufficient credits. Reserve required: {reserved} (based on timeout), have {balance}"
+            )
     
     # ========== JOB CREATION ==========
     job_id = generate_job_id()
@@ -215,19 +258,20 @@ async def submit_job(body: Dict[str, Any]) -> Dict[str, Any]:
             language=language,
             limits={"timeout_s": timeout_seconds},
             reserved_cost=reserved,
+            priority=priority,
         )
         
-        await job_queue.put(job_id)
-        await dispatch()
+        enqueue_job(job_id, now(), priority)
+        request_dispatch()
         
         logger.info(f"Job {job_id} submitted by user {user_id}, reserved={reserved} (time-based)")
         
-        return {
+        return ORJSONResponse({
             "job_id": job_id,
             "status": STATUS_QUEUED,
             "reserved": reserved,
             "message": "Charged by compute time when job completes; unused reserve refunded.",
-        }
+        })
         
     except Exception as e:
         logger.error(f"Job creation failed: {e}, refunding {reserved} credits to {user_id}")
@@ -239,22 +283,24 @@ async def submit_job(body: Dict[str, Any]) -> Dict[str, Any]:
 
 
 @app.get("/jobs")
-async def list_jobs(user_id: Optional[str] = None, limit: int = 50) -> Any:
+async def list_jobs(user_id: Optional[str] = None, limit: int = 50, full: bool = False) -> Any:
     """
     List jobs for a user. Requires user_id query parameter.
     Returns list of jobs, most recent first.
+    
+    Rows omit code/stdout/stderr unless full=true; GET /jobs/{job_id} returns the full job.
     """
     if not user_id:
         raise HTTPException(HTTP_BAD_REQUEST, "user_id query parameter is required")
     if not validate_user_id(user_id):
         raise HTTPException(HTTP_BAD_REQUEST, f"Invalid user_id: {user_id}")
     limit = min(max(1, limit), 100)
-    jobs = db_list_jobs_by_user(user_id, limit=limit)
+    jobs = db_list_jobs_by_user(user_id, limit=limit, columns=None if full else JOB_SUMMARY_COLUMNS)
     return jobs
 
 
-@app.get("/jobs/{job_id}")
-async def get_job(job_id: str) -> Dict[str, Any]:
+@app.get("/jobs/{job_id}", response_class=ORJSONResponse)
+async def get_job(job_id: str) -> ORJSONResponse:
     """
     Get job details by ID.
     
@@ -268,23 +314,25 @@ async def get_job(job_id: str) -> Dict[str, Any]:
     if not job:
         raise HTTPException(HTTP_NOT_FOUND, "Job not found")
     
-    return job
+    return ORJSONResponse(row_to_dict(job))
 
 
 # ============================================================================
 # WORKER ENDPOINTS
 # ============================================================================
 
-@app.get("/workers")
-async def list_workers():
-    """List all registered workers"""
-    workers = db_list_workers()
-    # Return just the list for backward compatibility
-    workers_list = []
-    for w in workers:
-        worker_dict = dict(w) if hasattr(w, 'keys') else w
-        workers_list.append(worker_dict)
-    return workers_list
+@app.get("/workers", response_class=ORJSONResponse)
+async def list_workers(
+    status: Optional[str] = None, since: Optional[float] = None, limit: Optional[int] = None
+) -> ORJSONResponse:
+    """List registered workers, optionally filtered by status / last heartbeat (all by default)"""
+    if limit is not None:
+        limit = max(1, limit)
+    # Return just the list for backward compatibility; the projection is fixed,
+    # so rows zip onto one shared key tuple instead of per-row Row.keys() calls
+    cols = WORKER_SUMMARY_COLUMNS
+    rows = db_list_workers(status=status, since=since, limit=limit, columns=cols)
+    return ORJSONResponse([dict(zip(cols, w)) for w in rows])
 
 
 @app.post("/workers/register")
@@ -323,6 +371,8 @@ async def register_worker_http(body: Dict[str, Any]) -> Dict[str, Any]:
         status="idle",
         owner_id=owner_id
     )
+    # The row no longer matches what the last WebSocket hello wrote
+    forget_hello_sig(worker_id)
     
     logger.info(f"Worker {worker_id} registered via HTTP, owner={owner_id}")
     
@@ -333,8 +383,8 @@ async def register_worker_http(body: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-@app.post("/workers/{worker_id}/heartbeat")
-async def heartbeat_path(worker_id: str) -> Dict[str, Any]:
+@app.post("/workers/{worker_id}/heartbeat", response_class=ORJSONResponse)
+async def heartbeat_path(worker_id: str) -> ORJSONResponse:
     """
     Worker heartbeat via path parameter.
     
@@ -343,22 +393,17 @@ async def heartbeat_path(worker_id: str) -> Dict[str, Any]:
     if not validate_uuid(worker_id):
         raise HTTPException(HTTP_BAD_REQUEST, "Invalid worker ID format")
     
-    timestamp = now()
-    get_db().execute(
-        "UPDATE workers SET last_heartbeat=? WHERE id=?",
-        (timestamp, worker_id)
-    )
-    get_db().commit()
+    timestamp = db_touch_worker(worker_id)
     
-    return {
+    return ORJSONResponse({
         "success": True,
         "worker_id": worker_id,
         "timestamp": timestamp
-    }
+    })
 
 
-@app.post("/workers/heartbeat")
-async def heartbeat_body(body: Dict[str, Any]) -> Dict[str, Any]:
+@app.post("/workers/heartbeat", response_class=ORJSONResponse)
+async def heartbeat_body(body: Dict[str, Any]) -> ORJSONResponse:
     """
     Worker heartbeat via request body.
     
@@ -371,26 +416,21 @@ async def heartbeat_body(body: Dict[str, Any]) -> Dict[str, Any]:
     if not validate_uuid(worker_id):
         raise HTTPException(HTTP_BAD_REQUEST, "Invalid worker ID format")
     
-    timestamp = now()
-    get_db().execute(
-        "UPDATE workers SET last_heartbeat=? WHERE id=?",
-        (timestamp, worker_id)
-    )
-    get_db().commit()
+    timestamp = db_touch_worker(worker_id)
     
-    return {
+    return ORJSONResponse({
         "success": True,
         "worker_id": worker_id,
         "timestamp": timestamp
-    }
+    })
 
 
 # ============================================================================
 # CREDIT ENDPOINTS
 # ============================================================================
 
-@app.get("/credits/{user_id}")
-async def get_credits(user_id: str) -> Dict[str, Any]:
+@app.get("/credits/{user_id}", response_class=ORJSONResponse)
+async def get_credits(user_id: str) -> ORJSONResponse:
     """
     Get user credit balance.
     
@@ -399,53 +439,62 @@ async def get_credits(user_id: str) -> Dict[str, Any]:
     if not validate_user_id(user_id):
         raise HTTPException(HTTP_BAD_REQUEST, f"Invalid user_id: {user_id}")
     
-    ensure_user(user_id)
-    balance = get_balance(user_id)
+    # ensure_user already returns the current balance
+    balance = ensure_user(user_id)
     
-    return {
+    return ORJSONResponse({
         "user_id": user_id,
         "balance": balance,
         "timestamp": now()
-    }
+    })
 
 
 # ============================================================================
 # HEALTH & STATUS ENDPOINTS
 # ============================================================================
 
-@app.get("/health")
-async def health_check():
+@app.get("/health", response_class=ORJSONResponse)
+async def health_check() -> ORJSONResponse:
     """Health check endpoint"""
-    return {
+    return ORJSONResponse({
         "status": "healthy",
         "service": "grid-x-coordinator",
         "timestamp": now()
-    }
+    })
 
 
-@app.get("/status")
-async def get_status():
+@app.get("/status", response_class=ORJSONResponse)
+async def get_status() -> ORJSONResponse:
     """Get coordinator status"""
-    workers = db_list_workers()
-    active_workers = [w for w in workers if w.get('status') == 'idle' or w.get('status') == 'busy']
+    counts = db_worker_status_counts()
+    active_count = counts.get('idle', 0) + counts.get('busy', 0)
     
-    return {
+    return ORJSONResponse({
         "service": "Grid-X Coordinator",
         "version": "1.0.0",
         "uptime": "running",
         "workers": {
-            "total": len(workers),
-            "active": len(active_workers)
+            "total": sum(counts.values()),
+            "active": active_count
         },
         "queue_size": job_queue.qsize(),
         "timestamp": now()
-    }
+    })
 
 
 # ============================================================================
 # MAIN ENTRY POINT
 # ============================================================================
 
+def _server_impl(preferred: str, fallback: str) -> str:
+    """Use the C implementation (uvicorn[standard]) when installed, else the pure-Python one."""
+    try:
+        __import__(preferred)
+        return preferred
+    except ImportError:
+        return fallback
+
+
 def main() -> None:
     """Main entry point. Uses PORT (Railway/Render) or GRIDX_HTTP_PORT for single-port deployment."""
     # Railway/Render set PORT; use it for both HTTP and WebSocket (same server)
@@ -466,7 +515,15 @@ def main() -> None:
         app,
         host="0.0.0.0",
         port=port,
-        log_level="info",
+        loop=_server_impl("uvloop", "asyncio"),
+        http=_server_impl("httptools", "h11"),
+        # Server logs only; app loggers keep their own level. Access log off
+        # drops a formatted line + write per request (GRIDX_ACCESS_LOG=1 to enable)
+        log_level=os.getenv("GRIDX_SERVER_LOG_LEVEL", "warning").lower(),
+        access_log=os.getenv("GRIDX_ACCESS_LOG", "0").lower() in ("1", "true", "yes"),
+        backlog=int(os.getenv("GRIDX_LISTEN_BACKLOG", "2048")),
+        # Keep idle connections longer than a fronting proxy's idle timeout (uvicorn default: 5s)
+        timeout_keep_alive=int(os.getenv("GRIDX_KEEPALIVE_TIMEOUT", "65")),
     )
 
 
@@ -3,33 +3,115 @@ Grid-X Coordinator - Job assignment logic (FIFO + first idle worker).
 """
 
 import asyncio
-import json
-from typing import Any, Dict, Optional
+import os
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import orjson
 
 from .database import (
     get_db,
+    get_thread_db,
+    db_transaction,
     db_get_job,
     db_set_job_assigned,
     db_set_job_completed,
     db_set_job_running,
     db_set_worker_status,
     db_get_worker,
+    db_invalidate_worker_cache,
+    db_invalidate_job_cache,
+    db_flush_worker_status,
+    db_revert_assignment,
+    get_db_path,
+    SQL_REQUEUE_STALE_JOB,
+    SQL_SET_WORKER_OFFLINE,
 )
 from .workers import (
-    get_idle_worker_id,
-    get_worker_ws,
-    lock,
-    set_worker_busy,
+    claim_idle_worker,
+    connected_worker_ids,
+    get_worker_outbox,
+    Outbox,
+    get_worker_owner,
     set_worker_idle,
     unregister_worker_ws,
 )
 from .credit_manager import settle_job
+from common.constants import DEFAULT_JOB_PRIORITY, MAX_QUEUE_SIZE, MAX_STORED_OUTPUT_LENGTH
+from common.utils import validate_uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Job queue: job_id strings
-job_queue: asyncio.Queue[str] = asyncio.Queue()
+# Job queue: (priority, submitted_at, job_id); lower priority first, then FIFO.
+# Submits are refused past MAX_QUEUED_JOBS (see queue_is_full); requeues of jobs
+# that were already counted are always accepted, so the dispatcher never blocks.
+job_queue: asyncio.PriorityQueue[Tuple[int, float, str]] = asyncio.PriorityQueue()
+MAX_QUEUED_JOBS = int(os.getenv("GRIDX_MAX_QUEUE_SIZE", str(MAX_QUEUE_SIZE)))
+
+
+def queue_is_full() -> bool:
+    """True when new submissions should be refused (backpressure)."""
+    return job_queue.qsize() >= MAX_QUEUED_JOBS
+
+
+def enqueue_job(job_id: str, submitted_at: float, priority: int = DEFAULT_JOB_PRIORITY) -> None:
+    """Queue a job for dispatch; requeued jobs keep their original submit time."""
+    job_queue.put_nowait((priority, submitted_at, job_id))
+
+# Seconds between flushes of buffered worker heartbeats/status (one commit per flush)
+WORKER_STATUS_FLUSH_INTERVAL = float(os.getenv("GRIDX_WORKER_FLUSH_INTERVAL", "0.5"))
+
+SQL_RUNNING_JOBS_WITH_HEARTBEAT = (
+    "SELECT j.id, j.worker_id, j.created_at, j.priority, w.last_heartbeat FROM jobs j "
+    "LEFT JOIN workers w ON w.id = j.worker_id WHERE j.status='running'"
+)
+
+
+def _requeue_stale_jobs(
+    heartbeat_timeout: float,
+    connected: FrozenSet[str],
+) -> List[Tuple[str, str, float, int]]:
+    """Watchdog DB pass; runs off the event loop on the thread's own connection.
+
+    Returns (job_id, worker_id, submitted_at, priority) for every job that was requeued.
+    The scan runs outside the transaction, so the event loop may complete a job
+    in between; the guarded UPDATE skips those (only rowcount == 1 is returned).
+    """
+    conn = get_thread_db()
+    # One query for all running jobs and their workers' heartbeats (no per-job lookup)
+    rows = conn.execute(SQL_RUNNING_JOBS_WITH_HEARTBEAT).fetchall()
+
+    now_ts = time.time()
+    stale = []
+    for r in rows:
+        worker_id = r["worker_id"]
+        # If worker has an active in-memory websocket, skip (it's connected)
+        if not worker_id or worker_id in connected:
+            continue
+
+        # If no heartbeat recorded or it's older than timeout, requeue
+        last = r["last_heartbeat"]
+        if not last or (now_ts - float(last) > heartbeat_timeout):
+            stale.append((r["id"], worker_id, r["created_at"] or now_ts, r["priority"]))
+
+    if not stale:
+        return []
+    # Requeue the jobs and mark their workers offline in one transaction
+    requeued = []
+    try:
+        with db_transaction(conn) as tx:
+            for job in stale:
+                if tx.execute(SQL_REQUEUE_STALE_JOB, (job[0], job[1])).rowcount == 1:
+                    requeued.append(job)
+            tx.executemany(
+                SQL_SET_WORKER_OFFLINE,
+                {("offline", job[1]) for job in requeued},
+            )
+    except Exception:
+        # db_transaction already rolled back
+        return []
+    return requeued
 
 
 async def watchdog_loop(check_interval: int = 15, heartbeat_timeout: int = 30) -> None:
@@ -40,48 +122,33 @@ async def watchdog_loop(check_interval: int = 15, heartbeat_timeout: int = 30) -
     """
     while True:
         try:
-            conn = get_db()
-            rows = conn.execute(
-                "SELECT id, worker_id FROM jobs WHERE status='running'"
-            ).fetchall()
-
-            for r in rows:
-                job_id = r["id"]
-                worker_id = r["worker_id"]
-                if not worker_id:
-                    continue
+            # Staleness is judged on DB heartbeats and job status, so persist buffered ones first
+            flush_job_results()
+            db_flush_worker_status()
+            # Scan + requeue run in a worker thread so the event loop keeps serving
+            db_pass = asyncio.ensure_future(asyncio.to_thread(
+                _requeue_stale_jobs, heartbeat_timeout, connected_worker_ids()
+            ))
+            try:
+                stale = await asyncio.shield(db_pass)
+            except asyncio.CancelledError:
+                # The thread can't be interrupted: let it finish before the
+                # caller goes on to close its connection
+                await asyncio.wait([db_pass])
+                raise
 
-                # If worker has an active in-memory websocket, skip (it's connected)
-                try:
-                    ws = get_worker_ws(worker_id)
-                    if ws:
-                        continue
-                except Exception:
-                    pass
-
-                w = conn.execute("SELECT last_heartbeat FROM workers WHERE id=?", (worker_id,)).fetchone()
-                last = w["last_heartbeat"] if w else None
-
-                # If no heartbeat recorded or it's older than timeout, requeue
-                import time
-                now_ts = time.time()
-                if not last or (now_ts - float(last) > heartbeat_timeout):
-                    # Mark worker offline and requeue
-                    try:
-                        conn.execute("UPDATE workers SET status=? WHERE id=?", ("offline", worker_id))
-                        conn.execute(
-                            "UPDATE jobs SET status=?, worker_id=? WHERE id=?",
-                            ("queued", None, job_id),
-                        )
-                        conn.commit()
-                        # Put back into in-memory queue for dispatch
-                        try:
-                            await job_queue.put(job_id)
-                        except Exception:
-                            pass
-                        logger.info(f"Watchdog requeued job {job_id} from worker {worker_id}")
-                    except Exception:
-                        conn.rollback()
+            # A result accepted during the pass completes the job at the next flush;
+            # don't hand it out again
+            pending = {r[0] for r in _pending_results}
+            for job_id, worker_id, submitted_at, priority in stale:
+                db_invalidate_worker_cache(worker_id)
+                if job_id in pending:
+                    continue
+                # Put back into in-memory queue for dispatch
+                enqueue_job(job_id, submitted_at, priority)
+                logger.info(f"Watchdog requeued job {job_id} from worker {worker_id}")
+            if stale:
+                request_dispatch()
 
         except Exception:
             pass
@@ -89,84 +156,231 @@ async def watchdog_loop(check_interval: int = 15, heartbeat_timeout: int = 30) -
         await asyncio.sleep(check_interval)
 
 
+async def worker_status_flush_loop(interval: float = WORKER_STATUS_FLUSH_INTERVAL) -> None:
+    """Periodically persist buffered worker status/heartbeat updates (one commit per pass)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            db_flush_worker_status()
+        except Exception as e:
+            logger.warning(f"worker status flush failed: {e}")
+
+
+# Set by request_dispatch(); dispatcher_loop() drains it, so a burst of triggers
+# costs one dispatch pass instead of one task per trigger
+_dispatch_event = asyncio.Event()
+
+
+def has_pending_jobs() -> bool:
+    """True when the in-memory queue holds jobs waiting for a worker."""
+    return not job_queue.empty()
+
+
+def request_dispatch() -> None:
+    """Ask the dispatcher to run (non-blocking; coalesces with pending requests).
+
+    No-op while the queue is empty: every enqueue is followed by a request, so
+    worker hellos/results on an idle grid never wake the dispatcher.
+    """
+    if not job_queue.empty():
+        _dispatch_event.set()
+
+
+async def dispatcher_loop() -> None:
+    """Single long-running task that runs dispatch() whenever it is requested."""
+    while True:
+        await _dispatch_event.wait()
+        _dispatch_event.clear()
+        try:
+            await dispatch()
+        except Exception as e:
+            logger.warning(f"dispatch failed: {e}")
+
+
+# Limits sent with every assignment
+ASSIGN_JOB_LIMITS = {"cpus": 1, "memory": "256m", "timeout_s": 30}
+
+# assign_job frame with the static skeleton pre-serialized; only the per-job
+# values are JSON-encoded and spliced in (same document as orjson.dumps of the dict)
+_ASSIGN_JOB_TEMPLATE = (
+    '{"type":"assign_job","job":{"job_id":%s,"kind":%s,"payload":{"script":%s},"limits":'
+    + orjson.dumps(ASSIGN_JOB_LIMITS).decode().replace("%", "%%")
+    + "}}"
+)
+
+
+def _assign_job_frame(job_id: str, kind: str, script: str) -> str:
+    """Serialized assign_job message for the worker."""
+    return _ASSIGN_JOB_TEMPLATE % (
+        orjson.dumps(job_id).decode(),
+        orjson.dumps(kind).decode(),
+        orjson.dumps(script).decode(),
+    )
+
+
+def _undelivered_callback(
+    job_id: str, worker_id: str, entry: Tuple[int, float, str], outbox: Outbox
+) -> Callable[[], None]:
+    def requeue() -> None:
+        logger.info("dispatch: assign_job for %s never reached worker %s; requeueing", job_id, worker_id)
+        # Worker state is only touched while this outbox is still the worker's: after a
+        # send failure / disconnect it is unregistered, and after a repeated hello the
+        # new connection's entry may be busy. Otherwise only the job is requeued.
+        owned = get_worker_outbox(worker_id) is outbox
+        if owned:
+            set_worker_idle(worker_id)
+        if db_revert_assignment(job_id, worker_id, release_worker=owned):
+            job_queue.put_nowait(entry)
+            request_dispatch()
+    return requeue
+
+
 async def dispatch() -> None:
     """
     FIFO + first idle worker. Assigns queued jobs to idle workers over WebSocket.
     On job completion, credits worker owner.
+    Runs without a global lock: each worker is claimed atomically, and the DB
+    assignment only succeeds while the job is still queued.
     """
     try:
-        async with lock:
-            while not job_queue.empty():
-                try:
-                    job_id = job_queue.get_nowait()
-                except asyncio.QueueEmpty:
-                    return
+        while not job_queue.empty():
+            try:
+                entry = job_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            job_id = entry[2]
 
-                job_row = db_get_job(job_id)
-                if not job_row:
-                    logger.warning(f"dispatch: Job {job_id} not found in DB")
-                    continue
+            job_row = db_get_job(job_id)
+            if not job_row:
+                logger.warning("dispatch: Job %s not found in DB", job_id)
+                continue
 
-                # Prefer an idle worker that is NOT owned by the job submitter
-                owner_to_exclude = (job_row.get("user_id") or "").strip()
-                idle_id: Optional[str] = get_idle_worker_id(exclude_owner=owner_to_exclude)
-                if idle_id is None:
-                    logger.warning(f"dispatch: No idle worker available (excluding owner={owner_to_exclude}). Queue size: {job_queue.qsize()}")
-                    # Put job back to queue head by re-adding and return
-                    try:
-                        await job_queue.put(job_id)
-                    except Exception:
-                        pass
-                    return
-
-                logger.info(f"dispatch: Assigning job {job_id} to worker {idle_id}")
-                set_worker_busy(idle_id)
-                db_set_worker_status(idle_id, "busy")
-                db_set_job_assigned(job_id, idle_id)
-
-                job_msg = {
-                    "type": "assign_job",
-                    "job": {
-                        "job_id": job_id,
-                        "kind": job_row["language"] or "python",
-                        "payload": {"script": job_row["code"]},
-                        "limits": {
-                            "cpus": 1,
-                            "memory": "256m",
-                            "timeout_s": 30,
-                        },
-                    },
-                }
-
-                ws = get_worker_ws(idle_id)
-                if not ws:
-                    # Revert and re-queue
-                    set_worker_idle(idle_id)
-                    db_set_worker_status(idle_id, "idle")
-                    get_db().execute(
-                        "UPDATE jobs SET status=?, worker_id=? WHERE id=?",
-                        ("queued", None, job_id),
-                    )
-                    get_db().commit()
-                    await job_queue.put(job_id)
-                    return
+            # Prefer an idle worker that is NOT owned by the job submitter
+            owner_to_exclude = (job_row["user_id"] or "").strip()
+            idle_id: Optional[str] = claim_idle_worker(exclude_owner=owner_to_exclude)
+            if idle_id is None:
+                # Expected whenever the grid is saturated: debug level, formatted lazily
+                logger.debug(
+                    "dispatch: No idle worker available (excluding owner=%s). Queue size: %d",
+                    owner_to_exclude, job_queue.qsize(),
+                )
+                # Put job back (same priority/submit time keeps its place) and return
+                job_queue.put_nowait(entry)
+                return
 
-                try:
-                    await ws.send(json.dumps(job_msg))
-                except Exception:
-                    set_worker_idle(idle_id)
-                    db_set_worker_status(idle_id, "idle")
-                    get_db().execute(
-                        "UPDATE jobs SET status=?, worker_id=? WHERE id=?",
-                        ("queued", None, job_id),
-                    )
-                    get_db().commit()
-                    await job_queue.put(job_id)
-                    return
+            logger.info("dispatch: Assigning job %s to worker %s", job_id, idle_id)
+            db_set_worker_status(idle_id, "busy")
+            if not db_set_job_assigned(job_id, idle_id):
+                # Job was assigned elsewhere meanwhile (e.g. queued twice); free the worker
+                set_worker_idle(idle_id)
+                db_set_worker_status(idle_id, "idle")
+                continue
+
+            job_msg = _assign_job_frame(job_id, job_row["language"] or "python", job_row["code"])
+
+            outbox = get_worker_outbox(idle_id)
+            if outbox is None:
+                # Revert and re-queue
+                set_worker_idle(idle_id)
+                db_revert_assignment(job_id, idle_id)
+                job_queue.put_nowait(entry)
+                return
+
+            # The connection's writer task sends it; if the frame is never
+            # delivered, the assignment is reverted and the job requeued
+            outbox.put((job_msg, _undelivered_callback(job_id, idle_id, entry, outbox)))
     except Exception:
         pass
 
 
+# stdout/stderr longer than this keep only their tail in the jobs row; the full
+# text is spilled to JOB_OUTPUT_DIR/<job_id>.<stream>
+STORED_OUTPUT_LIMIT = int(os.getenv("GRIDX_STORED_OUTPUT_LIMIT", str(MAX_STORED_OUTPUT_LENGTH)))
+JOB_OUTPUT_DIR = os.getenv("GRIDX_JOB_OUTPUT_DIR") or os.path.join(
+    os.path.dirname(get_db_path()) or ".", "jobs"
+)
+# Spilled output files older than this many seconds are deleted (0 keeps them forever)
+JOB_OUTPUT_RETENTION = float(os.getenv("GRIDX_JOB_OUTPUT_RETENTION", str(7 * 24 * 3600)))
+
+SQL_JOB_WORKER_IF_RUNNING = "SELECT worker_id FROM jobs WHERE id=? AND status='running'"
+
+
+def _spill_output(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _may_spill(job_id: Any, worker_id: Optional[str]) -> bool:
+    # Workers are unauthenticated: only the worker the job is running on may
+    # write its output file (job_id comes from the worker and names the file)
+    if not (isinstance(job_id, str) and validate_uuid(job_id)) or not worker_id:
+        return False
+    row = get_db().execute(SQL_JOB_WORKER_IF_RUNNING, (job_id,)).fetchone()
+    return row is not None and row["worker_id"] == worker_id
+
+
+async def cap_job_output(job_id: Any, worker_id: Optional[str], stream: str, text: Any) -> Any:
+    """
+    Truncate oversized job output to its last STORED_OUTPUT_LIMIT characters.
+    If the job is running on `worker_id`, the full text is written to disk off
+    the event loop and the stored tail is prefixed with a note naming the file
+    (relative to JOB_OUTPUT_DIR).
+    """
+    if not isinstance(text, str) or len(text) <= STORED_OUTPUT_LIMIT:
+        return text
+
+    tail = text[-STORED_OUTPUT_LIMIT:]
+    if _may_spill(job_id, worker_id):
+        name = f"{job_id}.{stream}"
+        try:
+            await asyncio.to_thread(_spill_output, os.path.join(JOB_OUTPUT_DIR, name), text)
+            return f"[truncated: full {stream} ({len(text)} chars) in {name}]\n{tail}"
+        except OSError as e:
+            logger.warning(f"cap_job_output: could not spill {stream} for job {job_id}: {e}")
+    return f"[truncated: last {STORED_OUTPUT_LIMIT} of {len(text)} chars]\n{tail}"
+
+
+def _prune_job_output(max_age: float) -> int:
+    """Delete spilled output files older than max_age seconds; returns how many"""
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = os.scandir(JOB_OUTPUT_DIR)
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+async def job_output_cleanup_loop(interval: float = 3600) -> None:
+    """Periodically delete spilled job output past JOB_OUTPUT_RETENTION (off the event loop)."""
+    if JOB_OUTPUT_RETENTION <= 0:
+        return
+    while True:
+        try:
+            removed = await asyncio.to_thread(_prune_job_output, JOB_OUTPUT_RETENTION)
+            if removed:
+                logger.info(f"Removed {removed} expired job output files")
+        except Exception as e:
+            logger.warning(f"job output cleanup failed: {e}")
+        await asyncio.sleep(interval)
+
+
+# Job results are written behind: buffered for up to this many seconds and
+# committed together (see flush_job_results)
+RESULT_FLUSH_DELAY = float(os.getenv("GRIDX_RESULT_FLUSH_DELAY", "0.02"))
+_pending_results: List[Tuple[Any, ...]] = []
+_result_flush_handle: Optional[asyncio.TimerHandle] = None
+
+
 def on_job_started(job_id: str) -> None:
     db_set_job_running(job_id)
 
@@ -178,19 +392,89 @@ def on_job_result(
     stdout: str,
     stderr: str,
     duration_seconds: Optional[float] = None,
+    seen_ns: Optional[int] = None,
 ) -> None:
+    """Settle and record a finished job and free its worker (write-behind).
+
+    The result is buffered and persisted by flush_job_results() within
+    RESULT_FLUSH_DELAY, together with any other results that arrive meanwhile.
+    The worker is only freed after its result is committed.
+
+    seen_ns: the receive loop's time.monotonic_ns() for this message, reused
+    as the worker's last_seen instead of reading the clock again.
+    """
+    global _result_flush_handle
     logger.info(
-        f"on_job_result: Job {job_id} completed on worker {worker_id} "
-        f"(exit_code={exit_code}, duration_seconds={duration_seconds})"
+        "on_job_result: Job %s completed on worker %s (exit_code=%s, duration_seconds=%s)",
+        job_id, worker_id, exit_code, duration_seconds,
     )
-    worker_row = db_get_worker(worker_id)
-    owner_id = (worker_row.get("owner_id") or "").strip() if worker_row else None
+    # Connected workers' owners are known in memory (flush falls back to the DB row)
+    owner_id = get_worker_owner(worker_id)
+    _pending_results.append(
+        (job_id, worker_id, owner_id, exit_code, stdout, stderr, duration_seconds, seen_ns)
+    )
+    if _result_flush_handle is None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Called outside the event loop: nothing would run the timer
+            flush_job_results()
+            return
+        _result_flush_handle = loop.call_later(RESULT_FLUSH_DELAY, flush_job_results)
+
 
-    # Time-based settle: refund unused reserve to submitter, credit worker owner
-    settle_job(job_id, owner_id, duration_seconds)
+def flush_job_results() -> int:
+    """
+    Persist buffered job results in one transaction (one commit per batch).
+    Each result runs in its own SAVEPOINT, so one failing job never discards
+    the others. Returns the number of results written.
+    """
+    global _result_flush_handle
+    if _result_flush_handle is not None:
+        _result_flush_handle.cancel()
+        _result_flush_handle = None
+    if not _pending_results:
+        return 0
+    batch = _pending_results[:]
+    _pending_results.clear()
 
-    db_set_job_completed(job_id, stdout, stderr, exit_code)
-    set_worker_idle(worker_id)
-    db_set_worker_status(worker_id, "idle")
+    done = []
+    try:
+        with db_transaction() as conn:
+            for job_id, worker_id, owner_id, exit_code, stdout, stderr, duration_seconds, seen_ns in batch:
+                if owner_id is None:
+                    worker_row = db_get_worker(worker_id)
+                    owner_id = worker_row["owner_id"] if worker_row else None
+                conn.execute("SAVEPOINT job_result")
+                try:
+                    # Time-based settle: refund unused reserve to submitter, credit worker owner
+                    settle_job(job_id, owner_id, duration_seconds)
+                    if not db_set_job_completed(job_id, stdout, stderr, exit_code):
+                        raise RuntimeError("could not mark job completed")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job_result")
+                    logger.error(f"flush_job_results: result for job {job_id} dropped: {e}")
+                conn.execute("RELEASE job_result")
+                done.append((worker_id, seen_ns))
+    except Exception:
+        # Whole batch rolled back (e.g. database locked): nothing was written, retry later.
+        # Rows read back inside the transaction may have been cached; drop them
+        for result in batch:
+            db_invalidate_job_cache(result[0])
+        _pending_results[:0] = batch
+        try:
+            _result_flush_handle = asyncio.get_running_loop().call_later(
+                RESULT_FLUSH_DELAY, flush_job_results
+            )
+        except RuntimeError:
+            # No loop (shutdown / sync caller): the next result or flush retries
+            pass
+        return 0
 
-    asyncio.create_task(dispatch())
+    for worker_id, seen_ns in done:
+        # A worker that disconnected meanwhile stays offline (its pending offline survives the release)
+        if get_worker_owner(worker_id) is not None:
+            set_worker_idle(worker_id, seen_ns)
+            db_set_worker_status(worker_id, "idle")
+    request_dispatch()
+    return len(batch)
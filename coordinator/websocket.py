@@ -1,63 +1,252 @@
 # coordinator/websocket.py
 from fastapi import WebSocket, WebSocketDisconnect
-import json, uuid
-from typing import Optional
+import asyncio, orjson, time, uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Optional MessagePack decoding for workers that send {"wire": "msgpack"} in hello
+# (inbound binary frames only; stdout/stderr are not JSON-escaped on the wire).
+# Frames to the worker stay JSON text, so the ack reports it as "wire_in".
+try:
+    from ormsgpack import unpackb as _msgpack_unpackb
+except ImportError:
+    try:
+        import msgpack
+        _msgpack_unpackb = partial(msgpack.unpackb, raw=False)
+    except ImportError:
+        _msgpack_unpackb = None
 
 from .workers import (
-    register_worker_ws, unregister_worker_ws,
-    update_worker_last_seen, lock
+    register_worker_ws, unregister_worker_ws, workers_ws, Outbox, OutboxItem, WorkerEntry
 )
 from .database import (
-    db_upsert_worker, db_set_worker_offline, get_db
+    db_upsert_worker, db_set_worker_offline, db_set_worker_status, get_db
 )
-from .scheduler import dispatch, on_job_started, on_job_result
+from .scheduler import request_dispatch, on_job_started, on_job_result, cap_job_output
+from common.utils import validate_uuid
 
+# worker_id -> hash of the hello fields last written by db_upsert_worker, so a
+# reconnect with identical ip/caps/owner skips the upsert and its commit.
+# LRU-bounded: hellos without a worker_id mint a new id every time.
+_hello_sigs: OrderedDict[str, int] = OrderedDict()
+_HELLO_SIGS_MAX = 4096
 
-async def worker_ws(websocket: WebSocket):
-    await websocket.accept()
-    worker_id: Optional[str] = None
 
-    try:
-        while True:
-            msg = await websocket.receive_json()
-            t = msg.get("type")
+def _remember_hello_sig(worker_id: str, sig: int) -> None:
+    _hello_sigs[worker_id] = sig
+    _hello_sigs.move_to_end(worker_id)
+    if len(_hello_sigs) > _HELLO_SIGS_MAX:
+        _hello_sigs.popitem(last=False)
 
-            if t == "hello":
-                worker_id = msg.get("worker_id") or str(uuid.uuid4())
-                caps = msg.get("caps", {})
-                owner_id = msg.get("owner_id", "")
 
-                async with lock:
-                    register_worker_ws(worker_id, websocket, caps, owner_id)
+def forget_hello_sig(worker_id: str) -> None:
+    """Drop the cached hello signature after the worker row was written elsewhere
+    (e.g. POST /workers/register), so the next hello upserts again."""
+    _hello_sigs.pop(worker_id, None)
 
-                db_upsert_worker(worker_id, "remote", caps, "idle", owner_id)
-                await websocket.send_json({"type": "hello_ack", "worker_id": worker_id})
-                await dispatch()
-                continue
 
-            if not worker_id:
-                continue
+# hello_ack with the fixed parts pre-rendered; wire is one of our own constants
+_HELLO_ACK_TEMPLATE = '{"type":"hello_ack","worker_id":"%s","wire_in":"%s"}'
+
 
-            update_worker_last_seen(worker_id)
+def _hello_ack_frame(worker_id: str, wire: str) -> str:
+    # A UUID has nothing to escape; any other client-chosen id goes through orjson
+    if validate_uuid(worker_id):
+        return _HELLO_ACK_TEMPLATE % (worker_id, wire)
+    return orjson.dumps({"type": "hello_ack", "worker_id": worker_id, "wire_in": wire}).decode()
 
-            if t == "job_started":
-                on_job_started(msg.get("job_id"))
 
-            if t == "job_result":
-                on_job_result(
-                    msg.get("job_id"),
-                    worker_id,
-                    msg.get("exit_code", 0),
-                    msg.get("stdout", ""),
-                    msg.get("stderr", ""),
-                    msg.get("duration_seconds"),
+def _fail_items(items: List[OutboxItem]) -> None:
+    for _, on_fail in items:
+        if on_fail is not None:
+            on_fail()
+
+
+async def _writer_loop(websocket: WebSocket, worker_id: str, outbox: Outbox, batch: bool) -> None:
+    """
+    Sole sender for one worker connection. Waits for a frame, then takes every
+    other frame already queued. Workers that announced "batch" in hello get
+    them as one {"type": "batch", "msgs": [...]} frame; others get them back
+    to back. Frames that were not sent have their on_fail callback run.
+    On a send failure the worker is unregistered first, so nothing is
+    dispatched into an outbox that no longer has a writer.
+    """
+    while True:
+        await outbox.ready.wait()
+        items = outbox.take_all()
+        sent = 0
+        try:
+            if batch and len(items) > 1:
+                # Frames are pre-serialized JSON, so the envelope is a join, not a re-encode
+                await websocket.send_text(
+                    '{"type":"batch","msgs":[' + ",".join(frame for frame, _ in items) + "]}"
                 )
-                await dispatch()
+                sent = len(items)
+            else:
+                for frame, _ in items:
+                    await websocket.send_text(frame)
+                    sent += 1
+        except asyncio.CancelledError:
+            # Stopped mid-send: the frame being written (the whole envelope when
+            # batched) may have reached the worker, so it is left to the watchdog
+            # rather than requeued (no double run); the rest were never sent
+            _fail_items(items[len(items) if batch and len(items) > 1 else sent + 1:])
+            raise
+        except Exception:
+            entry = workers_ws.get(worker_id)
+            # Only if this outbox is still the worker's (a newer hello may have replaced it)
+            if entry is not None and entry.outbox is outbox:
+                unregister_worker_ws(worker_id)
+            _fail_items(items[sent:])
+            _fail_items(outbox.take_all())
+            try:
+                # Unblock the receive loop so the connection is torn down
+                await websocket.close()
+            except Exception:
+                pass
+            return
+
+
+async def _stop_writer(writer: Optional[asyncio.Task], outbox: Optional[Outbox]) -> None:
+    if writer is not None:
+        writer.cancel()
+        try:
+            await writer
+        except BaseException:
+            pass
+    if outbox is not None:
+        _fail_items(outbox.take_all())
+
+
+@dataclass(slots=True)
+class _Connection:
+    """Per-connection state shared by the message handlers"""
+    websocket: WebSocket
+    worker_id: Optional[str] = None
+    # Registry entry captured at hello (no per-message lookup)
+    entry: Optional[WorkerEntry] = None
+    outbox: Optional[Outbox] = None
+    writer: Optional[asyncio.Task] = None
+    # Decoder for binary frames once msgpack is negotiated (None: binary frames are JSON)
+    unpack: Optional[Callable[[bytes], Any]] = None
+    # time.monotonic_ns() of the message being handled
+    seen_ns: int = 0
+
+
+async def _handle_hello(msg: Dict[str, Any], conn: _Connection) -> None:
+    worker_id = msg.get("worker_id")
+    if not worker_id:
+        # Only workers that bring no id of their own pay for a fresh one
+        worker_id = str(uuid.uuid4())
+    conn.worker_id = worker_id
+    caps = msg.get("caps", {})
+    owner_id = msg.get("owner_id", "")
+    # Inbound (worker -> coordinator) wire format; the ack tells the worker what was accepted
+    wire = "msgpack" if msg.get("wire") == "msgpack" and _msgpack_unpackb else "json"
+    conn.unpack = _msgpack_unpackb if wire == "msgpack" else None
+
+    register_worker_ws(worker_id, conn.websocket, caps, owner_id)
+    entry = conn.entry = workers_ws[worker_id]
+    # First in the new outbox, so it precedes any assign_job
+    entry.outbox.put((_hello_ack_frame(worker_id, wire), None))
+    # A repeated hello replaces the registry entry; retire the old writer
+    await _stop_writer(conn.writer, conn.outbox)
+    conn.outbox = entry.outbox
+    conn.writer = asyncio.create_task(
+        _writer_loop(conn.websocket, worker_id, conn.outbox, bool(msg.get("batch")))
+    )
+
+    sig = hash(("remote", orjson.dumps(caps, option=orjson.OPT_SORT_KEYS), owner_id))
+    if _hello_sigs.get(worker_id) == sig:
+        # Row is current; only flip it back to idle (buffered, refreshes heartbeat)
+        _hello_sigs.move_to_end(worker_id)
+        db_set_worker_status(worker_id, "idle")
+    else:
+        db_upsert_worker(worker_id, "remote", caps, "idle", owner_id)
+        _remember_hello_sig(worker_id, sig)
+    request_dispatch()
+
+
+async def _handle_job_started(msg: Dict[str, Any], conn: _Connection) -> None:
+    on_job_started(msg.get("job_id"))
+
+
+def _output_text(value: Any) -> str:
+    # msgpack may carry output as bin (bytes); anything that isn't text must
+    # not bypass the size cap or be stored as a BLOB
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", "replace")
+    return "" if value is None else str(value)
+
+
+async def _handle_job_result(msg: Dict[str, Any], conn: _Connection) -> None:
+    job_id = msg.get("job_id")
+    # Cap output at ingress so multi-MB results never reach the jobs row
+    stdout = await cap_job_output(job_id, conn.worker_id, "stdout", _output_text(msg.get("stdout", "")))
+    stderr = await cap_job_output(job_id, conn.worker_id, "stderr", _output_text(msg.get("stderr", "")))
+    on_job_result(
+        job_id,
+        conn.worker_id,
+        msg.get("exit_code", 0),
+        stdout,
+        stderr,
+        msg.get("duration_seconds"),
+        conn.seen_ns,
+    )
+    # No dispatch request here: the worker is freed (and dispatch requested)
+    # once its result is flushed, so the receive loop never waits on dispatch
+
+
+# Message type -> handler (one dict lookup per message instead of an if-chain).
+# Only hello is accepted before the worker has registered.
+_HANDLERS: Dict[str, Callable[[Dict[str, Any], _Connection], Awaitable[None]]] = {
+    "hello": _handle_hello,
+    "job_started": _handle_job_started,
+    "job_result": _handle_job_result,
+}
+
+
+async def worker_ws(websocket: WebSocket):
+    await websocket.accept()
+    conn = _Connection(websocket)
+
+    try:
+        while True:
+            # orjson: job_result frames carry full stdout/stderr, stdlib json is the bottleneck.
+            # Text and binary frames are both accepted (orjson.loads takes str or bytes,
+            # so workers sending orjson.dumps() output as binary skip a decode)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            raw = message.get("text")
+            if raw is not None:
+                msg = orjson.loads(raw)
+            elif conn.unpack is not None:
+                msg = conn.unpack(message.get("bytes"))
+            else:
+                msg = orjson.loads(message.get("bytes"))
+
+            handler = _HANDLERS.get(msg.get("type"))
+            entry = conn.entry
+            if entry is not None:
+                # One clock read per message (any type), shared by everything that stamps last_seen
+                conn.seen_ns = entry.last_seen = time.monotonic_ns()
+            elif handler is not _handle_hello:
+                continue
+            if handler is not None:
+                await handler(msg, conn)
 
     except WebSocketDisconnect:
         pass
     finally:
+        worker_id = conn.worker_id
         if worker_id:
-            async with lock:
-                unregister_worker_ws(worker_id)
+            unregister_worker_ws(worker_id)
+            # Unregistered first, so nothing new lands in the outbox; undelivered
+            # assignments are requeued before the worker is marked offline
+            await _stop_writer(conn.writer, conn.outbox)
             db_set_worker_offline(worker_id)
@@ -3,72 +3,197 @@ Grid-X Coordinator - Worker registry management (in-memory WS state + DB).
 """
 
 import asyncio
-from typing import Any, Dict, Optional
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
 
-from .database import now
+# last_seen is time.monotonic_ns() (an int, no float alloc per message);
+# worker_last_seen() converts it to epoch seconds for display
+_mono_ns = time.monotonic_ns
+_MONO_EPOCH = time.time() - time.monotonic()
 
-# In-memory: worker_id -> {ws, caps, status, last_seen}
-workers_ws: Dict[str, Dict[str, Any]] = {}
-lock = asyncio.Lock()
+# Serialized frame + callback run if it is never delivered
+OutboxItem = Tuple[str, Optional[Callable[[], None]]]
+
+
+class Outbox:
+    """Pending frames for one connection: producers append, the writer takes them all.
+
+    A list plus one Event instead of asyncio.Queue: there is a single consumer
+    that always takes everything, so no per-item waiter bookkeeping is needed.
+    """
+
+    __slots__ = ("items", "ready")
+
+    def __init__(self) -> None:
+        self.items: List[OutboxItem] = []
+        self.ready = asyncio.Event()
+
+    def put(self, item: OutboxItem) -> None:
+        self.items.append(item)
+        self.ready.set()
+
+    def take_all(self) -> List[OutboxItem]:
+        items = self.items
+        self.items = []
+        self.ready.clear()
+        return items
+
+
+@dataclass(slots=True)
+class WorkerEntry:
+    """Registry entry for one connected worker (slots: compact, attribute access, no key hashing)"""
+    ws: Any
+    outbox: Outbox
+    caps: Dict[str, Any]
+    owner_id: str
+    # Fixed at registration: caps don't change for the life of a connection
+    can_execute: bool
+    status: str = "idle"
+    last_seen: int = 0
+
+
+# In-memory: worker_id -> WorkerEntry; outbox is drained by the connection's writer task
+# No lock: every function below is synchronous (no await), so each runs to
+# completion on the event loop before any other coroutine sees the registry
+workers_ws: Dict[str, WorkerEntry] = {}
+
+# Flat indexes kept alongside workers_ws and maintained by the setters below:
+# - idle workers that can execute, in the order they became idle (dict as an ordered set)
+# - owner of every connected worker
+# - number of idle workers per owner
+_idle_workers: Dict[str, None] = {}
+_worker_owner: Dict[str, str] = {}
+_idle_owner_counts: Dict[str, int] = {}
+_NOT_IDLE = object()
+
+
+def _can_execute(caps: Optional[Dict[str, Any]]) -> bool:
+    # Only consider workers that report they can execute tasks
+    return bool((caps or {}).get("can_execute", True))
+
+
+def _mark_idle(worker_id: str) -> None:
+    # Appends, so the worker goes to the back of the idle order
+    if worker_id not in _idle_workers:
+        _idle_workers[worker_id] = None
+        owner = _worker_owner[worker_id]
+        _idle_owner_counts[owner] = _idle_owner_counts.get(owner, 0) + 1
+
+
+def _unmark_idle(worker_id: str) -> None:
+    if _idle_workers.pop(worker_id, _NOT_IDLE) is not _NOT_IDLE:
+        owner = _worker_owner[worker_id]
+        left = _idle_owner_counts[owner] - 1
+        if left:
+            _idle_owner_counts[owner] = left
+        else:
+            del _idle_owner_counts[owner]
 
 
 def get_idle_worker_id(exclude_owner: Optional[str] = None) -> Optional[str]:
     """Return first idle connected worker id.
 
     If `exclude_owner` is provided, skip workers whose `owner_id` matches it.
+    O(1) when nothing needs skipping, or when every idle worker is the owner's;
+    otherwise the scan stops at the first non-owner, so it visits at most
+    (owner's idle count + 1) entries and keeps the idle (FIFO) order.
     """
-    import logging
-    logger = logging.getLogger(__name__)
-
-    logger.debug(f"get_idle_worker_id: checking {len(workers_ws)} workers in registry")
-    for wid, w in workers_ws.items():
-        # Only consider workers that report they can execute tasks
-        caps = w.get("caps") or {}
-        can_execute = caps.get("can_execute", True)
-        status = w.get("status")
-        owner = w.get("owner_id")
-        logger.debug(f"  Worker {wid[:12]}...: status={status}, can_execute={can_execute}, owner={owner}, caps={caps}")
-        if exclude_owner and owner and owner == exclude_owner:
-            logger.debug(f"  → Skipping worker {wid[:12]}... (owner excluded)")
-            continue
-        if status == "idle" and can_execute:
-            logger.debug(f"  → Selected worker {wid[:12]}...")
+    if not exclude_owner or exclude_owner not in _idle_owner_counts:
+        return next(iter(_idle_workers), None)
+    if _idle_owner_counts[exclude_owner] == len(_idle_workers):
+        return None
+    owner_of = _worker_owner
+    for wid in _idle_workers:
+        if owner_of[wid] != exclude_owner:
             return wid
-    logger.debug(f"  → No idle worker found")
     return None
 
 
+def connected_worker_ids() -> FrozenSet[str]:
+    """Snapshot of connected worker ids (safe to hand to another thread)"""
+    return frozenset(workers_ws)
+
+
+def get_worker_owner(worker_id: str) -> Optional[str]:
+    """Owner of a connected worker, or None if it is not connected"""
+    return _worker_owner.get(worker_id)
+
+
+def claim_idle_worker(exclude_owner: Optional[str] = None) -> Optional[str]:
+    """Pick an idle worker and mark it busy in one step.
+
+    There is no await between the check and the claim, so concurrent dispatch
+    tasks on the event loop can never claim the same worker (no lock needed).
+    """
+    worker_id = get_idle_worker_id(exclude_owner=exclude_owner)
+    if worker_id is not None:
+        set_worker_busy(worker_id)
+    return worker_id
+
+
 def set_worker_busy(worker_id: str) -> None:
-    if worker_id in workers_ws:
-        workers_ws[worker_id]["status"] = "busy"
-        workers_ws[worker_id]["last_seen"] = now()
+    entry = workers_ws.get(worker_id)
+    if entry is not None:
+        entry.status = "busy"
+        entry.last_seen = _mono_ns()
+        _unmark_idle(worker_id)
 
 
-def set_worker_idle(worker_id: str) -> None:
-    if worker_id in workers_ws:
-        workers_ws[worker_id]["status"] = "idle"
-        workers_ws[worker_id]["last_seen"] = now()
+def set_worker_idle(worker_id: str, seen_ns: Optional[int] = None) -> None:
+    entry = workers_ws.get(worker_id)
+    if entry is not None:
+        entry.status = "idle"
+        entry.last_seen = seen_ns if seen_ns is not None else _mono_ns()
+        if entry.can_execute:
+            _mark_idle(worker_id)
 
 
 def register_worker_ws(worker_id: str, ws: Any, caps: Dict[str, Any], owner_id: str = "") -> None:
-    workers_ws[worker_id] = {
-        "ws": ws,
-        "caps": caps,
-        "status": "idle",
-        "last_seen": now(),
-        "owner_id": owner_id,
-    }
+    entry = workers_ws[worker_id] = WorkerEntry(
+        ws=ws,
+        outbox=Outbox(),
+        caps=caps,
+        owner_id=owner_id,
+        can_execute=_can_execute(caps),
+        last_seen=_mono_ns(),
+    )
+    # Re-registration moves the worker to the back of the idle order (and may change owner);
+    # _unmark_idle is a no-op for workers that are not in the idle index
+    _unmark_idle(worker_id)
+    _worker_owner[worker_id] = owner_id
+    if entry.can_execute:
+        _mark_idle(worker_id)
 
 
 def unregister_worker_ws(worker_id: str) -> None:
     workers_ws.pop(worker_id, None)
+    _unmark_idle(worker_id)
+    _worker_owner.pop(worker_id, None)
 
 
 def update_worker_last_seen(worker_id: str) -> None:
-    if worker_id in workers_ws:
-        workers_ws[worker_id]["last_seen"] = now()
+    touch_worker(worker_id, _mono_ns())
+
+
+def touch_worker(worker_id: str, seen_ns: int) -> None:
+    """Set last_seen from a time.monotonic_ns() reading the caller already took"""
+    entry = workers_ws.get(worker_id)
+    if entry is not None:
+        entry.last_seen = seen_ns
+
+
+def worker_last_seen(worker_id: str) -> Optional[float]:
+    """Epoch seconds of the last message from a connected worker"""
+    entry = workers_ws.get(worker_id)
+    return _MONO_EPOCH + entry.last_seen / 1e9 if entry is not None else None
 
 
 def get_worker_ws(worker_id: str) -> Optional[Any]:
     entry = workers_ws.get(worker_id)
-    return entry["ws"] if entry else None
+    return entry.ws if entry is not None else None
+
+
+def get_worker_outbox(worker_id: str) -> Optional[Outbox]:
+    entry = workers_ws.get(worker_id)
+    return entry.outbox if entry is not None else None